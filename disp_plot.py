@@ -1,34 +1,50 @@
 import matplotlib.pyplot as plt
+from matplotlib.colors import LinearSegmentedColormap
 import numpy as np
 # import open3d as o3d
 from flow_utils import inv_project
 
 
+# KITTI disparity color-coding: relative segment lengths and the colors at the segment boundaries
+KITTI_SEGMENT_LENGTHS = [114, 185, 114, 174, 114, 185, 114]
+KITTI_COLORS = [[0,0,0], [0,0,1], [1,0,0], [1,0,1], [0,1,0], [0,1,1], [1,1,0], [1,1,1]]
+KITTI_STEPS = [0.0] + [sum(KITTI_SEGMENT_LENGTHS[:i+1]) / float(sum(KITTI_SEGMENT_LENGTHS)) for i in range(7)]
+
+# the same color-coding as matplotlib colormap, e.g. for imshow(disp, cmap=KITTI_COLORMAP, clim=(0, np.nanmax(disp)))
+KITTI_COLORMAP = LinearSegmentedColormap.from_list("kitti", list(zip(KITTI_STEPS, KITTI_COLORS)), N=1024)
+KITTI_COLORMAP.set_bad("black")
+
+
 def colorplot(disp, scale=None):
-    """same colorplot as KITTI"""
-    # TODO: implement as matplotlib colormap
-    initial_steps = [114, 185, 114, 174, 114, 185, 114]
-    colors = [[0,0,0], [0,0,1], [1,0,0], [1,0,1], [0,1,0], [0,1,1], [1,1,0], [1,1,1]]
-    steps = [0.0] + [sum(initial_steps[:i+1]) / float(sum(initial_steps)) for i in range(7)]
+    """same colorplot as KITTI
+    disp: disparity map, nan values are black
+    scale: disparity mapped to white, defaults to the maximum disparity
+    """
+    steps = list(KITTI_STEPS)
     # make sure that disp=256 is also colored
     steps[-1] += 0.0001
 
-    h,w = disp.shape
-    result = np.zeros((h,w,3),dtype=np.uint8)
-
     if scale is None:
         scale = np.nanmax(disp)
     disp_ = disp / scale
     disp_ = np.clip(disp_, 0, 1)
 
-    for i in range(len(steps)-1):
-        col1 = np.asarray(colors[i], dtype=np.uint8)
-        col2 = np.asarray(colors[i+1], dtype=np.uint8)
-        alpha = (disp_ - steps[i]) / (steps[i+1]-steps[i])
-        alpha = alpha[:,:,np.newaxis]
-        interpol = ((1-alpha) * col1 + alpha*col2) * 255
-        result[(disp_>=steps[i]) & (disp_<steps[i+1]),:] = np.asarray(np.floor(interpol), dtype=np.uint8)[(disp_>=steps[i]) & (disp_<steps[i+1]),:]
-
+    # segment i holds the values in [steps[i], steps[i+1]), compared and interpolated in the precision of disp_
+    # values outside of all segments (nan) use an extra segment [0, 1) from black to black
+    lower = np.asarray(steps[:-1] + [0.0], dtype=disp_.dtype)
+    widths = np.asarray([steps[i+1] - steps[i] for i in range(len(steps)-1)] + [1.0], dtype=disp_.dtype)
+    col1 = np.asarray(KITTI_COLORS[:-1] + [[0,0,0]], dtype=np.uint8)
+    col2 = np.asarray(KITTI_COLORS[1:] + [[0,0,0]], dtype=np.uint8)
+    segment = np.searchsorted(np.asarray(steps, dtype=disp_.dtype), disp_, side="right") - 1
+    outside = (segment < 0) | (segment >= len(steps) - 1)
+    segment[outside] = len(steps) - 1
+
+    alpha = (disp_ - lower[segment]) / widths[segment]
+    np.copyto(alpha, 0, where=outside)
+    alpha = alpha[:,:,np.newaxis]
+    interpol = ((1-alpha) * col1[segment] + alpha*col2[segment]) * 255
+    result = np.floor(interpol).astype(np.uint8)
+    result[outside] = 0
     return result
 
 
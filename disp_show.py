@@ -59,7 +59,9 @@ def showDisp(filepath):
         disp0 = getdisp0(filepath)
 
         if buttons.value_selected == "KITTI":
-            ax_implot.set_data(disp_plot.colorplot(disp))
+            # colored by the colormap of imshow instead of rendering an RGB image with disp_plot.colorplot
+            ax_implot.set_data(disp)
+            ax_implot.set(cmap=disp_plot.KITTI_COLORMAP, clim=(0, np.nanmax(disp)))
         elif buttons.value_selected == "turbo":
             ax_implot.set_data(disp)
             ax_implot.set(cmap="turbo", clim=(0,100))
@@ -74,7 +76,9 @@ def showDisp(filepath):
 
     def update(val):
         if buttons.value_selected == "KITTI":
-            ax_implot.set_data(disp_plot.colorplot(disp))
+            # colored by the colormap of imshow instead of rendering an RGB image with disp_plot.colorplot
+            ax_implot.set_data(disp)
+            ax_implot.set(cmap=disp_plot.KITTI_COLORMAP, clim=(0, np.nanmax(disp)))
         elif buttons.value_selected == "turbo":
             ax_implot.set_data(disp)
             ax_implot.set(cmap="turbo", clim=(0,100))
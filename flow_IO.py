@@ -1,9 +1,13 @@
+import os
 import struct
 import numpy as np
 import png
 import re
 import sys
 import csv
+import zlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from PIL import Image
 import h5py
 
@@ -12,29 +16,82 @@ FLO_TAG_FLOAT = 202021.25  # first 4 bytes in flo file; check for this when READ
 FLO_TAG_STRING = "PIEH"    # first 4 bytes in flo file; use this when WRITING the file
 FLO_UNKNOWN_FLOW_THRESH = 1e9 # flo format threshold for unknown values
 FLO_UNKNOWN_FLOW = 1e10 # value to use to represent unknown flow in flo file format
+FLO_HEADER_SIZE = 12 # tag, width and height
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n" # first 8 bytes in png file
 
+# sparse flow: shape (height, width), flat row-major indices of the valid pixels and their flow values (N x 2)
+SparseFlow = namedtuple("SparseFlow", ["shape", "indices", "values"])
 
-def readFlowFile(filepath):
+# storage options of flo5/dsp5 files (see _createHdf5Dataset)
+HDF5_DEFAULT_OPTIONS = {"chunks": True, "compression": "gzip", "compression_opts": 5, "shuffle": False, "dtype": None}
+HDF5_PRESETS = {
+    # contiguous and uncompressed: fastest to write, largest files
+    "fast-write": {"chunks": None, "compression": None, "shuffle": False},
+    # gzip level 9 with byte shuffling: slow to write, smallest lossless files
+    "small-archive": {"chunks": True, "compression": "gzip", "compression_opts": 9, "shuffle": True},
+    # 64x64 tiles with fast lzf compression: region reads only decompress the tiles they touch
+    "tile-readable": {"chunks": (64, 64), "compression": "lzf", "shuffle": True},
+}
+
+
+def readFlowFile(filepath, region=None, stride=1, dtype=np.float32):
     """read flow files in several formats. The resulting flow has shape height x width x 2.
     For positions where there is no groundtruth available, the flow is set to np.nan.
     Supports flo (Sintel), png (KITTI), npy (numpy), pfm (FlyingThings3D) and flo5 (Spring) file format.
     filepath: path to the flow file
+    region: optional tuple (y0, y1, x0, x1); only flow[y0:y1, x0:x1] is read
+    stride: only every stride-th row and column (of the region) is read
+    dtype: floating point type of the returned flow (np.float16, np.float32 or np.float64)
     returns: flow with shape height x width x 2
     """
     if filepath.endswith(".flo"):
-        return readFloFlow(filepath)
+        return readFloFlow(filepath, dtype=dtype, region=region, stride=stride)
     elif filepath.endswith(".png"):
-        return readPngFlow(filepath)
+        return _cropArray(readPngFlow(filepath, dtype=dtype), region, stride)
     elif filepath.endswith(".npy"):
-        return readNpyFlow(filepath)
+        return readNpyFlow(filepath, region=region, stride=stride, dtype=dtype)
     elif filepath.endswith(".pfm"):
-        return readPfmFlow(filepath)
+        return readPfmFlow(filepath, region=region, stride=stride, dtype=dtype)
     elif filepath.endswith(".flo5"):
-        return readFlo5Flow(filepath)
+        return readFlo5Flow(filepath, region=region, stride=stride, dtype=dtype)
     else:
         raise ValueError(f"readFlowFile: Unknown file format for {filepath}")
 
 
+def readFlowFiles(filepaths, workers=None, out=None, ordered=True, region=None, stride=1, dtype=None):
+    """read many flow files concurrently on a thread pool (see readFlowFile).
+    Decompression in zlib, PIL and h5py releases the GIL, so the files are decoded in parallel.
+    filepaths: list of paths to flow files
+    workers: number of threads, defaults to the number of CPUs
+    out: optional preallocated array with shape N x height x width x 2; flow i is written to out[i]
+    ordered: if True, the flows are yielded in the order of filepaths, otherwise as soon as they are decoded
+    region, stride: only read a part of every flow file, see readFlowFile
+    dtype: floating point type of the flows, defaults to the type of out or np.float32
+    returns: generator of tuples (index, flow); flow is a view of out[index] if out is given
+    """
+    if dtype is None:
+        dtype = np.float32 if out is None else out.dtype
+
+    if out is not None and len(out) != len(filepaths):
+        raise ValueError(f"readFlowFiles: out has space for {len(out)} flows but {len(filepaths)} paths were given")
+
+    def read(i):
+        flow = readFlowFile(filepaths[i], region=region, stride=stride, dtype=dtype)
+        if out is None:
+            return i, flow
+        out[i] = flow
+        return i, out[i]
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = [pool.submit(read, i) for i in range(len(filepaths))]
+        try:
+            for future in (futures if ordered else as_completed(futures)):
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
 def writeFlowFile(flow, filepath):
     """write optical flow to file. Supports flo (Sintel), png (KITTI) and npy (numpy) file format.
     flow: optical flow with shape height x width x 2. Invalid values should be represented as np.nan
@@ -61,9 +118,95 @@ def writeFlowFile(flow, filepath):
         raise ValueError(f"writeFlowFile: Unknown file format for {filepath}")
 
 
-def readFloFlow(filepath):
+def probeFlowFile(filepath):
+    """read only the header of a flow or disparity file and report its layout.
+    Supports flo, png, pfm, npy, flo5 and dsp5 files. Comparing file_size and expected_size detects truncated files.
+    filepath: path to the file
+    returns: dictionary with the keys
+        format: file extension without the dot
+        width, height, channels: size of the stored field as it is stored on disk (e.g. 3 channels for KITTI png flow)
+        dtype: stored sample type as string, e.g. "float32" or "uint16"
+        file_size: size of the file on disk in bytes
+        expected_size: size in bytes according to the header, or None if it cannot be derived from the header (hdf5)
+    """
+    file_size = os.path.getsize(filepath)
+    fmt = os.path.splitext(filepath)[1][1:].lower()
+
+    if fmt == "flo":
+        with open(filepath, "rb") as f:
+            width, height = _readFloHeader(f, filepath)
+        channels, dtype = 2, "float32"
+        expected_size = FLO_HEADER_SIZE + width * height * channels * 4
+    elif fmt == "png":
+        width, height, channels, dtype, expected_size = _probePngFile(filepath)
+    elif fmt == "pfm":
+        with open(filepath, "rb") as f:
+            color, width, height, _ = _readPfmHeader(f)
+            channels, dtype = (3 if color else 1), "float32"
+            expected_size = f.tell() + width * height * channels * 4
+    elif fmt == "npy":
+        with open(filepath, "rb") as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, _, npy_dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, _, npy_dtype = np.lib.format.read_array_header_2_0(f)
+            expected_size = f.tell() + int(np.prod(shape)) * npy_dtype.itemsize
+        height, width = shape[:2]
+        channels = shape[2] if len(shape) > 2 else 1
+        dtype = npy_dtype.name
+    elif fmt in ["flo5", "dsp5"]:
+        key = "flow" if fmt == "flo5" else "disparity"
+        with h5py.File(filepath, "r") as f:
+            if key not in f.keys():
+                raise IOError(f"File {filepath} does not have a '{key}' key. Is this a valid {fmt} file?")
+            shape = f[key].shape
+            dtype = f[key].dtype.name
+        height, width = shape[:2]
+        channels = shape[2] if len(shape) > 2 else 1
+        expected_size = None
+    else:
+        raise ValueError(f"probeFlowFile: Unknown file format for {filepath}")
+
+    return {"format": fmt, "width": width, "height": height, "channels": channels, "dtype": dtype,
+            "file_size": file_size, "expected_size": expected_size}
+
+
+def _probePngFile(filepath):
+    """read the IHDR chunk of a png file and walk the chunk headers up to IEND without reading the image data.
+    returns: width, height, channels, dtype, expected_size (end of the IEND chunk, or beyond the end of the file if it is truncated)
+    """
+    with open(filepath, "rb") as f:
+        if f.read(len(PNG_SIGNATURE)) != PNG_SIGNATURE:
+            raise IOError(f"probe png file ({filepath}): not a png file")
+        length, chunktype = struct.unpack(">I4s", f.read(8))
+        if chunktype != b"IHDR":
+            raise IOError(f"probe png file ({filepath}): IHDR chunk missing")
+        width, height, bitdepth, colortype = struct.unpack(">IIBB", f.read(10))
+        channels = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}[colortype]
+        dtype = "uint16" if bitdepth == 16 else "uint8"
+
+        # every chunk: 4 bytes length, 4 bytes type, data, 4 bytes crc
+        position = len(PNG_SIGNATURE)
+        while True:
+            f.seek(position)
+            header = f.read(8)
+            if len(header) < 8:
+                # truncated: at least a chunk header and crc are missing
+                return width, height, channels, dtype, position + 12
+            length, chunktype = struct.unpack(">I4s", header)
+            position += 12 + length
+            if chunktype == b"IEND":
+                return width, height, channels, dtype, position
+
+
+def readFloFlow(filepath, dtype=np.float32, mmap=False, region=None, stride=1):
     """read optical flow from file stored in .flo file format as used in the Sintel dataset (Butler et al., 2012)
     filepath: path to file where to read from
+    dtype: floating point type of the returned flow, e.g. np.float32 (default), np.float16 or np.float64
+    mmap: if True, the payload is memory-mapped (copy-on-write) instead of read into memory
+    region: optional tuple (y0, y1, x0, x1); only the rows and columns of flow[y0:y1, x0:x1] are read from disk
+    stride: only every stride-th row and column (of the region) is read
     returns: flow as a numpy array with shape height x width x 2
     ---
     ".flo" file format used for optical flow evaluation
@@ -89,47 +232,66 @@ def readFloFlow(filepath):
         raise IOError(f"read flo file ({filepath}): extension .flo expected")
 
     with open(filepath, "rb") as stream:
-        tag = struct.unpack("f", stream.read(4))[0]
-        width = struct.unpack("i", stream.read(4))[0]
-        height = struct.unpack("i", stream.read(4))[0]
+        width, height = _readFloHeader(stream, filepath)
+
+        nBands = 2
+        nbytes = height * width * nBands * 4
 
-        if tag != FLO_TAG_FLOAT:  # simple test for correct endian-ness
-            raise IOError(f"read flo file({filepath}): wrong tag (possibly due to big-endian machine?)")
+        cropped = region is not None or stride != 1
+        if mmap or cropped:
+            filesize = os.fstat(stream.fileno()).st_size
+            if filesize < FLO_HEADER_SIZE + nbytes:
+                raise IOError(f"read flo file({filepath}): file is too short")
+            if filesize > FLO_HEADER_SIZE + nbytes:
+                raise IOError(f"read flo file({filepath}): file is too long")
+            flow = np.memmap(stream, dtype="<f4", mode="c", offset=FLO_HEADER_SIZE, shape=(height, width, nBands))
+            if cropped:
+                # only the pages of the selected rows are loaded
+                flow = np.array(flow[_regionSlices(region, stride)])
+        else:
+            data = bytearray(nbytes)
+            if stream.readinto(data) != nbytes:
+                raise IOError(f"read flo file({filepath}): file is too short")
+            if stream.read(1) != b'':
+                raise IOError(f"read flo file({filepath}): file is too long")
+            flow = np.frombuffer(data, dtype="<f4").reshape((height, width, nBands))
 
-        # another sanity check to see that integers were read correctly (99999 should do the trick...)
-        if width < 1 or width > 99999:
-            raise IOError(f"read flo file({filepath}): illegal width {width}")
+    # unknown values are set to nan (before the conversion, the threshold does not fit into float16)
+    flow[np.abs(flow) > FLO_UNKNOWN_FLOW_THRESH] = np.nan
 
-        if height < 1 or height > 99999:
-            raise IOError(f"read flo file({filepath}): illegal height {height}")
+    return flow.astype(dtype, copy=False)
 
-        nBands = 2
-        flow = []
 
-        n = nBands * width
-        for _ in range(height):
-            data = stream.read(n * 4)
-            if data is None:
-                raise IOError(f"read flo file({filepath}): file is too short")
-            data = np.asarray(struct.unpack(f"{n}f", data))
-            data = data.reshape((width, nBands))
-            flow.append(data)
+def _readFloHeader(stream, filepath):
+    """read and check the 12 byte header of a .flo file
+    stream: binary stream positioned at the start of the file
+    filepath: file path used for error messages
+    returns: width, height
+    """
+    header = stream.read(FLO_HEADER_SIZE)
+    if len(header) != FLO_HEADER_SIZE:
+        raise IOError(f"read flo file({filepath}): file is too short")
+
+    tag, width, height = struct.unpack("<fii", header)
 
-        if stream.read(1) != b'':
-            raise IOError(f"read flo file({filepath}): file is too long")
+    if tag != FLO_TAG_FLOAT:  # simple test for correct endian-ness
+        raise IOError(f"read flo file({filepath}): wrong tag (possibly due to big-endian machine?)")
 
-        flow = np.asarray(flow)
-        # unknown values are set to nan
-        flow[np.abs(flow) > FLO_UNKNOWN_FLOW_THRESH] = np.nan
+    # another sanity check to see that integers were read correctly (99999 should do the trick...)
+    if width < 1 or width > 99999:
+        raise IOError(f"read flo file({filepath}): illegal width {width}")
 
-        return flow
+    if height < 1 or height > 99999:
+        raise IOError(f"read flo file({filepath}): illegal height {height}")
+
+    return width, height
 
 
 def writeFloFlow(flow, filepath):
     """
     write optical flow in .flo format to file as used in the Sintel dataset (Butler et al., 2012)
     flow: optical flow with shape height x width x 2
-    filepath: optical flow file path to be saved
+    filepath: optical flow file path to be saved, or an already opened binary stream
     ---
     ".flo" file format used for optical flow evaluation
 
@@ -147,51 +309,135 @@ def writeFloFlow(flow, filepath):
             the float values for u and v, interleaved, in row order, i.e.,
             u[row0,col0], v[row0,col0], u[row0,col1], v[row0,col1], ...
     """
+    data = encodeFloFlow(flow)
+
+    if hasattr(filepath, "write"):
+        result = filepath.write(data)
+    else:
+        with open(filepath, "wb") as f:
+            result = f.write(data)
+
+    if result != len(data):
+        raise IOError(f"write flo file {filepath}: problem writing file")
 
+
+def encodeFloFlow(flow):
+    """encode optical flow in .flo format (see writeFloFlow) without writing it to disk.
+    The input array is not modified; nan values are replaced by FLO_UNKNOWN_FLOW in the output only.
+    flow: optical flow with shape height x width x 2
+    returns: bytearray containing header and payload of the .flo file
+    """
     height, width, nBands = flow.shape
+    if nBands != 2:
+        raise IOError(f"encode flo file: expected shape height x width x 2 but received {flow.shape}")
 
-    with open(filepath, "wb") as f:
-        if f is None:
-            raise IOError(f"write flo file {filepath}: file could not be opened")
-
-        # write header
-        result = f.write(FLO_TAG_STRING.encode("ascii"))
-        result += f.write(struct.pack('i', width))
-        result += f.write(struct.pack('i', height))
-        if result != 12:
-            raise IOError(f"write flo file {filepath}: problem writing header")
-
-        # write content
-        n = nBands * width
-        for i in range(height):
-            data = flow[i, :, :].flatten()
-            data[np.isnan(data)] = FLO_UNKNOWN_FLOW
-            result = f.write(struct.pack(f"{n}f", *data))
-            if result != n * 4:
-                raise IOError(f"write flo file {filepath}: problem writing row {i}")
-
-
-def readPngFlow(filepath):
+    data = bytearray(FLO_HEADER_SIZE + height * width * nBands * 4)
+    struct.pack_into("<4sii", data, 0, FLO_TAG_STRING.encode("ascii"), width, height)
+
+    payload = np.frombuffer(data, dtype="<f4", offset=FLO_HEADER_SIZE).reshape((height, width, nBands))
+    np.copyto(payload, flow, casting="unsafe")
+    payload[np.isnan(payload)] = FLO_UNKNOWN_FLOW
+    return data
+
+
+def readPngFlow(filepath, dtype=np.float32):
     """read optical flow from file stored in png file format as used in the KITTI 12 (Geiger et al., 2012) and KITTI 15 (Menze et al., 2015) dataset.
     filepath: path to file where to read from
+    dtype: floating point type of the returned flow
     returns: flow as a numpy array with shape height x width x 2. Invalid values are represented as np.nan
     """
-    # adapted from https://github.com/liruoteng/OpticalFlowToolkit
-    flow_object = png.Reader(filename=filepath)
-    flow_direct = flow_object.asDirect()
-    flow_data = list(flow_direct[2])
-    (w, h) = flow_direct[3]['size']
-    flow = np.zeros((h, w, 3), dtype=np.float64)
-    for i in range(len(flow_data)):
-        flow[i, :, 0] = flow_data[i][0::3]
-        flow[i, :, 1] = flow_data[i][1::3]
-        flow[i, :, 2] = flow_data[i][2::3]
-
-    invalid_idx = (flow[:, :, 2] == 0)
-    flow[:, :, 0:2] = (flow[:, :, 0:2] - 2 ** 15) / 64.0
-    flow[invalid_idx, 0] = np.nan
-    flow[invalid_idx, 1] = np.nan
-    return flow[:, :, :2]
+    return convertPngFlow(*readPngFlowRaw(filepath), dtype=dtype)
+
+
+def readPngFlowRaw(filepath):
+    """read optical flow from a KITTI png file without converting it to floating point.
+    Use convertPngFlow to obtain the same result as readPngFlow.
+    filepath: path to file where to read from
+    returns: tuple (raw, valid) of the uint16 flow with shape height x width x 2 and the boolean valid mask with shape height x width
+    """
+    data = _readPng16(filepath)
+    if data.ndim != 3 or data.shape[2] != 3:
+        raise IOError(f"read png flow ({filepath}): assumed 3 channels but got shape {data.shape}")
+    return data[:, :, :2], data[:, :, 2] != 0
+
+
+def convertPngFlow(raw, valid, dtype=np.float32):
+    """convert raw KITTI png flow (see readPngFlowRaw) to floating point flow.
+    raw: uint16 flow with shape height x width x 2
+    valid: boolean valid mask with shape height x width
+    dtype: floating point type of the returned flow
+    returns: flow with shape height x width x 2. Invalid values are represented as np.nan
+    """
+    # flipping the top bit maps the offset encoding (value + 2**15) to int16 without a wider intermediate
+    flow = np.divide((raw ^ 0x8000).view(np.int16), 64.0, dtype=dtype)
+    flow[~valid] = np.nan
+    return flow
+
+
+def readPngFlowSparse(filepath, dtype=np.float32):
+    """read a KITTI png flow file into a sparse representation that only contains the valid pixels.
+    filepath: path to file where to read from
+    dtype: floating point type of the flow values
+    returns: SparseFlow (shape, indices, values)
+    """
+    return convertPngFlowSparse(readPngFlowSparseRaw(filepath), dtype=dtype)
+
+
+def readPngFlowSparseRaw(filepath):
+    """read a KITTI png flow file into a packed sparse representation (see convertPngFlowSparse).
+    The packed array is a single uint32 array [height, width, indices..., values...] in which every valid pixel
+    takes 8 bytes: its flat index and its two raw uint16 flow components (u in the upper, v in the lower 16 bits).
+    It can be cached and memory-mapped like any dense array.
+    filepath: path to file where to read from
+    returns: 1D uint32 array
+    """
+    raw, valid = readPngFlowRaw(filepath)
+    height, width = valid.shape
+    indices = np.flatnonzero(valid)
+    selected = raw.reshape(-1, 2)[indices]
+    packed = np.empty(2 + 2 * len(indices), dtype=np.uint32)
+    packed[:2] = height, width
+    packed[2:2 + len(indices)] = indices
+    values = packed[2 + len(indices):]
+    np.left_shift(selected[:, 0], 16, out=values, dtype=np.uint32)
+    np.bitwise_or(values, selected[:, 1], out=values)
+    return packed
+
+
+def convertPngFlowSparse(packed, dtype=np.float32):
+    """convert packed sparse KITTI png flow (see readPngFlowSparseRaw) to SparseFlow.
+    The flow values equal those of readPngFlow at the valid pixels.
+    packed: 1D uint32 array
+    dtype: floating point type of the flow values
+    returns: SparseFlow (shape, indices, values)
+    """
+    count = (len(packed) - 2) // 2
+    raw = np.empty((count, 2), dtype=np.uint16)
+    np.right_shift(packed[2 + count:], 16, out=raw[:, 0], casting="unsafe")
+    np.bitwise_and(packed[2 + count:], 0xFFFF, out=raw[:, 1], casting="unsafe")
+    values = np.divide((raw ^ 0x8000).view(np.int16), 64.0, dtype=dtype)
+    return SparseFlow((int(packed[0]), int(packed[1])), packed[2:2 + count], values)
+
+
+def denseToSparseFlow(flow):
+    """convert a dense flow field to SparseFlow, pixels with nan are left out
+    flow: flow with shape height x width x 2
+    returns: SparseFlow (shape, indices, values)
+    """
+    indices = np.flatnonzero(~(np.isnan(flow[:, :, 0]) | np.isnan(flow[:, :, 1])))
+    return SparseFlow(flow.shape[:2], indices, flow.reshape(-1, 2)[indices])
+
+
+def sparseToDenseFlow(sparse, dtype=None):
+    """convert SparseFlow to a dense flow field with nan at the missing pixels
+    sparse: SparseFlow (shape, indices, values)
+    dtype: floating point type of the returned flow, defaults to the type of the values
+    returns: flow with shape height x width x 2
+    """
+    dtype = sparse.values.dtype if dtype is None else dtype
+    flow = np.full(tuple(sparse.shape) + (2,), np.nan, dtype=dtype)
+    flow.reshape(-1, 2)[sparse.indices] = sparse.values
+    return flow
 
 
 def writePngFlow(flow, filename):
@@ -199,27 +445,119 @@ def writePngFlow(flow, filename):
     flow: optical flow in shape height x width x 2, invalid values should be represented as np.nan
     filepath: path to file where to write to
     """
+    height, width = flow.shape[:2]
+    data = np.empty((height, width, 3), dtype=np.uint16)
+    data[:, :, 2] = ~(np.isnan(flow[:, :, 0]) | np.isnan(flow[:, :, 1]))
+
     flow = 64.0 * flow + 2**15
-    width = flow.shape[1]
-    height = flow.shape[0]
-    valid_map = np.ones([flow.shape[0], flow.shape[1], 1])
-    valid_map[np.isnan(flow[:,:,0]) | np.isnan(flow[:,:,1])] = 0
     flow = np.nan_to_num(flow)
-    flow = np.concatenate([flow, valid_map], axis=-1)
     flow = np.clip(flow, 0, 2**16-1)
-    flow = flow.astype(np.uint16)
-    flow = np.reshape(flow, (-1, width*3))
-    with open(filename, "wb") as f:
-        writer = png.Writer(width=width, height=height, bitdepth=16, greyscale=False)
-        writer.write(f, flow)
+    data[:, :, :2] = flow
+
+    _writePng16(data, filename)
+
+
+def _readPng16(filepath):
+    """read a 16 bit greyscale or RGB png file.
+    The image is decoded by PIL if possible and by pypng otherwise.
+    filepath: path to file where to read from
+    returns: uint16 array with shape height x width (greyscale) or height x width x 3 (RGB)
+    """
+    data = _readPng16Pil(filepath)
+    if data is None:
+        data = _readPng16Pypng(filepath)
+    return data
 
 
-def readNpyFlow(filepath):
+def _readPng16Pil(filepath):
+    """decode a 16 bit png file with PIL.
+    PIL stores RGB images with 8 bits per channel, so 16 bit RGB files are decoded twice: once keeping the
+    high bytes ("RGB;16B") and once keeping the low bytes ("RGB;16L") of every sample.
+    Both passes run zlib inflation and filter reconstruction in C, which is much faster than pypng.
+    filepath: path to file where to read from
+    returns: uint16 array or None if the file is not a non-interlaced 16 bit greyscale or RGB png file
+    """
+    with Image.open(filepath) as image:
+        if image.format != "PNG" or image.info.get("interlace") or len(image.tile) != 1:
+            return None
+        tile = image.tile[0]
+        rawmode = tile[3]
+        if rawmode == "I;16B":
+            return np.array(image, dtype=np.uint16)
+        if rawmode != "RGB;16B":
+            return None
+        high = np.asarray(image)
+
+    with Image.open(filepath) as image:
+        image.tile = [tuple(tile[:3]) + ("RGB;16L",)]
+        low = np.asarray(image)
+
+    data = high.astype(np.uint16) << 8
+    data |= low
+    return data
+
+
+def _readPng16Pypng(filepath):
+    """decode a 16 bit png file with pypng (slow fallback for files PIL cannot decode losslessly).
+    filepath: path to file where to read from
+    returns: uint16 array with shape height x width (single channel) or height x width x channels
+    """
+    # adapted from https://github.com/liruoteng/OpticalFlowToolkit
+    image_direct = png.Reader(filename=filepath).asDirect()
+    (w, h) = image_direct[3]['size']
+    channels = image_direct[3]['planes']
+    data = np.array(list(image_direct[2]), dtype=np.uint16).reshape((h, w, channels))
+    if channels == 1:
+        return data[:, :, 0]
+    return data
+
+
+def _writePng16(data, filepath):
+    """write a 16 bit greyscale or RGB png file. All rows are stored unfiltered and compressed in a single zlib call.
+    data: uint16 array with shape height x width (greyscale) or height x width x 3 (RGB)
+    filepath: path to file where to write to
+    """
+    height, width = data.shape[:2]
+    channels = 1 if data.ndim == 2 else data.shape[2]
+    if channels not in (1, 3):
+        raise IOError(f"write png file {filepath}: expected 1 or 3 channels but got shape {data.shape}")
+
+    # every row starts with the filter type byte (0: no filter), followed by big-endian samples
+    rows = np.zeros((height, 1 + width * channels * 2), dtype=np.uint8)
+    rows[:, 1:] = data.astype(">u2").view(np.uint8).reshape((height, -1))
+
+    colortype = 0 if channels == 1 else 2
+    header = struct.pack(">IIBBBBB", width, height, 16, colortype, 0, 0, 0)
+
+    with open(filepath, "wb") as f:
+        f.write(PNG_SIGNATURE)
+        _writePngChunk(f, b"IHDR", header)
+        _writePngChunk(f, b"IDAT", zlib.compress(rows))
+        _writePngChunk(f, b"IEND", b"")
+
+
+def _writePngChunk(stream, chunktype, data):
+    stream.write(struct.pack(">I", len(data)))
+    stream.write(chunktype)
+    stream.write(data)
+    stream.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(chunktype))))
+
+
+def readNpyFlow(filepath, region=None, stride=1, dtype=None):
     """read numpy array from file.
     filepath: file to read from
+    region: optional tuple (y0, y1, x0, x1); only arr[y0:y1, x0:x1] is read
+    stride: only every stride-th row and column (of the region) is read
+    dtype: optional type the array is converted to, None keeps the stored type
     returns: numpy array
     """
-    return np.load(filepath)
+    if region is None and stride == 1:
+        arr = np.load(filepath)
+    else:
+        arr = _cropArray(np.load(filepath, mmap_mode="r"), region, stride)
+    if dtype is not None:
+        arr = arr.astype(dtype, copy=False)
+    return arr
 
 
 def writeNpyFile(arr, filepath):
@@ -230,44 +568,87 @@ def writeNpyFile(arr, filepath):
     np.save(filepath, arr)
 
 
-def writeFlo5File(flow, filename):
+def writeFlo5File(flow, filename, preset=None, **options):
+    """write optical flow to a flo5 (hdf5) file as used in the Spring dataset (Mehl et al., 2023).
+    flow: optical flow with shape height x width x 2
+    filename: path to file where to write to
+    preset: optional name of a storage preset, see HDF5_PRESETS
+    options: storage options overriding the preset, see _createHdf5Dataset
+    """
     with h5py.File(filename, "w") as f:
-        f.create_dataset("flow", data=flow, compression="gzip", compression_opts=5)
+        _createHdf5Dataset(f, "flow", flow, preset, options)
 
 
-def readFlo5Flow(filename):
+def readFlo5Flow(filename, region=None, stride=1, dtype=np.float32):
     with h5py.File(filename, "r") as f:
         if "flow" not in f.keys():
             raise IOError(f"File {filename} does not have a 'flow' key. Is this a valid flo5 file?")
-        return f["flow"][()]
+        return _readHdf5Dataset(f["flow"], region, stride, dtype)
 
 
-def readPfmFlow(filepath):
+def readPfmFlow(filepath, mmap=False, compact=False, region=None, stride=1, dtype=np.float32):
     """read optical flow from file stored in pfm file format as used in the FlyingThings3D (Mayer et al., 2016) dataset.
     filepath: path to file where to read from
+    mmap: if True, the payload is memory-mapped instead of read into memory (see readPfmFile)
+    compact: if True, return a contiguous copy of the two flow channels, which releases the file buffer
+    region: optional tuple (y0, y1, x0, x1); only flow[y0:y1, x0:x1] is read
+    stride: only every stride-th row and column (of the region) is read
+    dtype: floating point type of the returned flow. If it equals the stored type (little-endian float32),
+           a memory-mapped result stays a view of the file
     returns: flow as a numpy array with shape height x width x 2.
     """
-    flow = readPfmFile(filepath)
+    flow = readPfmFile(filepath, mmap=mmap, region=region, stride=stride)
     if len(flow.shape) != 3:
         raise IOError(f"read pfm flow: PFM file has wrong shape (assumed to be w x h x 3): {flow.shape}")
     if flow.shape[2] != 3:
         raise IOError(f"read pfm flow: PFM file has wrong shape (assumed to be w x h x 3): {flow.shape}")
     # remove third channel -> is all zeros
-    return flow[:,:,:2]
+    flow = flow[:,:,:2]
+    if compact:
+        return np.ascontiguousarray(flow, dtype=dtype)
+    return flow.astype(dtype, copy=False)
 
 
-def readPfmFile(filepath):
+def readPfmFile(filepath, mmap=False, region=None, stride=1):
     """
     adapted from https://lmb.informatik.uni-freiburg.de/resources/datasets/SceneFlowDatasets.en.html
+    filepath: path to file where to read from
+    mmap: if True, the payload after the header is memory-mapped read-only instead of read into memory.
+          The pages are only loaded when the returned array is accessed.
+    region: optional tuple (y0, y1, x0, x1) in top-row-first coordinates; only data[y0:y1, x0:x1] is read
+    stride: only every stride-th row and column (of the region) is read
+    returns: flipped (top row first) view of the data with shape height x width x 3 or height x width,
+             or a copy of the selected region
     """
-    file = open(filepath, 'rb')
+    cropped = region is not None or stride != 1
+    with open(filepath, 'rb') as file:
+        color, width, height, endian = _readPfmHeader(file)
+        shape = (height, width, 3) if color else (height, width)
+        count = int(np.prod(shape))
+        offset = file.tell()
+
+        if mmap or cropped:
+            if os.fstat(file.fileno()).st_size < offset + 4 * count:
+                raise IOError(f"read pfm file ({filepath}): file is too short")
+            data = np.memmap(file, dtype=endian + 'f', mode='r', offset=offset, shape=shape)
+        else:
+            data = np.fromfile(file, endian + 'f', count=count)
+            if data.size != count:
+                raise IOError(f"read pfm file ({filepath}): file is too short")
+            data = np.reshape(data, shape)
 
-    color = None
-    width = None
-    height = None
-    scale = None
-    endian = None
+    data = np.flipud(data)
+    if cropped:
+        # only the pages of the selected rows are loaded
+        data = np.array(data[_regionSlices(region, stride)])
+    return data #, scale
 
+
+def _readPfmHeader(file):
+    """read the three header lines of a pfm file
+    file: binary stream positioned at the start of the file
+    returns: color (True for 3 channels), width, height, endian ('<' or '>')
+    """
     header = file.readline().rstrip()
     if header.decode("ascii") == 'PF':
         color = True
@@ -285,16 +666,10 @@ def readPfmFile(filepath):
     scale = float(file.readline().decode("ascii").rstrip())
     if scale < 0: # little-endian
         endian = '<'
-        scale = -scale
     else:
         endian = '>' # big-endian
 
-    data = np.fromfile(file, endian + 'f')
-    shape = (height, width, 3) if color else (height, width)
-
-    data = np.reshape(data, shape)
-    data = np.flipud(data)
-    return data #, scale
+    return color, width, height, endian
 
 
 def writePfmFile(image, filepath):
@@ -302,7 +677,6 @@ def writePfmFile(image, filepath):
     adapted from https://lmb.informatik.uni-freiburg.de/resources/datasets/SceneFlowDatasets.en.html
     """
     scale=1
-    file = open(filepath, 'wb')
 
     color = None
 
@@ -318,67 +692,90 @@ def writePfmFile(image, filepath):
     else:
         raise Exception('Image must have H x W x 3, H x W x 1 or H x W dimensions.')
 
-    file.write('PF\n' if color else 'Pf\n'.encode())
-    file.write('%d %d\n'.encode() % (image.shape[1], image.shape[0]))
-
     endian = image.dtype.byteorder
 
     if endian == '<' or endian == '=' and sys.byteorder == 'little':
         scale = -scale
 
-    file.write('%f\n'.encode() % scale)
+    with open(filepath, 'wb') as file:
+        file.write(b'PF\n' if color else b'Pf\n')
+        file.write('%d %d\n'.encode() % (image.shape[1], image.shape[0]))
+        file.write('%f\n'.encode() % scale)
+        image.tofile(file)
 
-    image.tofile(file)
 
-
-def readDispFile(filepath):
+def readDispFile(filepath, region=None, stride=1, dtype=np.float32):
     """read disparity (or disparity change) from file. The resulting numpy array has shape height x width.
     For positions where there is no groundtruth available, the value is set to np.nan.
     Supports png (KITTI), npy (numpy) and pfm (FlyingThings3D) file format.
     filepath: path to the flow file
+    region: optional tuple (y0, y1, x0, x1); only disp[y0:y1, x0:x1] is read
+    stride: only every stride-th row and column (of the region) is read
+    dtype: floating point type of the returned disparity (np.float16, np.float32 or np.float64)
     returns: disparity with shape height x width
     """
     if filepath.endswith(".png"):
-        return readPngDisp(filepath)
+        return _cropArray(readPngDisp(filepath, dtype=dtype), region, stride)
     elif filepath.endswith(".npy"):
-        return readNpyFlow(filepath)
+        return readNpyFlow(filepath, region=region, stride=stride, dtype=dtype)
     elif filepath.endswith(".pfm"):
-        return readPfmDisp(filepath)
+        return readPfmDisp(filepath, region=region, stride=stride, dtype=dtype)
     elif filepath.endswith(".dsp5"):
-        return readDsp5Disp(filepath)
+        return readDsp5Disp(filepath, region=region, stride=stride, dtype=dtype)
     else:
         raise ValueError(f"readDispFile: Unknown file format for {filepath}")
 
 
-def readPngDisp(filepath):
+def readPngDisp(filepath, dtype=np.float32):
     """read disparity from file stored in png file format as used in the KITTI 12 (Geiger et al., 2012) and KITTI 15 (Menze et al., 2015) dataset.
     filepath: path to file where to read from
+    dtype: floating point type of the returned disparity
     returns: disparity as a numpy array with shape height x width. Invalid values are represented as np.nan
     """
-    # adapted from https://github.com/liruoteng/OpticalFlowToolkit
-    image_object = png.Reader(filename=filepath)
-    image_direct = image_object.asDirect()
-    image_data = list(image_direct[2])
-    (w, h) = image_direct[3]['size']
-    channel = len(image_data[0]) // w
-    if channel != 1:
+    return convertPngDisp(*readPngDispRaw(filepath), dtype=dtype)
+
+
+def readPngDispRaw(filepath):
+    """read disparity from a KITTI png file without converting it to floating point.
+    Use convertPngDisp to obtain the same result as readPngDisp.
+    filepath: path to file where to read from
+    returns: tuple (raw, valid) of the uint16 disparity and the boolean valid mask, both with shape height x width
+    """
+    data = _readPng16(filepath)
+    if data.ndim != 2:
         raise IOError("read png disp: assumed channels to be 1!")
-    disp = np.zeros((h, w), dtype=np.float64)
-    for i in range(len(image_data)):
-        disp[i, :] = image_data[i][:]
-    disp[disp == 0] = np.nan
-    return disp[:, :] / 256.0
+    return data, data != 0
+
 
+def convertPngDisp(raw, valid, dtype=np.float32):
+    """convert raw KITTI png disparity (see readPngDispRaw) to floating point disparity.
+    raw: uint16 disparity with shape height x width
+    valid: boolean valid mask with shape height x width
+    dtype: floating point type of the returned disparity
+    returns: disparity with shape height x width. Invalid values are represented as np.nan
+    """
+    # raw values above 65504 overflow float16, so the division is done in at least float32
+    disp = np.divide(raw, 256.0, dtype=np.promote_types(dtype, np.float32)).astype(dtype, copy=False)
+    disp[~valid] = np.nan
+    return disp
 
-def readPfmDisp(filepath):
+
+def readPfmDisp(filepath, mmap=False, compact=False, region=None, stride=1, dtype=np.float32):
     """read disparity or disparity change from file stored in pfm file format as used in the FlyingThings3D (Mayer et al., 2016) dataset.
     filepath: path to file where to read from
+    mmap: if True, the payload is memory-mapped instead of read into memory (see readPfmFile)
+    compact: if True, return a contiguous copy, which releases the file buffer
+    region: optional tuple (y0, y1, x0, x1); only disp[y0:y1, x0:x1] is read
+    stride: only every stride-th row and column (of the region) is read
+    dtype: floating point type of the returned disparity (see readPfmFlow)
     returns: disparity as a numpy array with shape height x width. Invalid values are represented as np.nan
     """
-    disp = readPfmFile(filepath)
+    disp = readPfmFile(filepath, mmap=mmap, region=region, stride=stride)
     if len(disp.shape) != 2:
         raise IOError(f"read pfm disp: PFM file has wrong shape (assumed to be w x h): {disp.shape}")
-    return disp
+    if compact:
+        return np.ascontiguousarray(disp, dtype=dtype)
+    return disp.astype(dtype, copy=False)
 
 
 def writePngDisp(disp, filepath):
@@ -387,26 +784,251 @@ def writePngDisp(disp, filepath):
     filepath: path to file where to write to
     """
     disp = 256 * disp
-    width = disp.shape[1]
-    height = disp.shape[0]
     disp = np.clip(disp, 0, 2**16-1)
     disp = np.nan_to_num(disp).astype(np.uint16)
-    disp = np.reshape(disp, (-1, width))
-    with open(filepath, "wb") as f:
-        writer = png.Writer(width=width, height=height, bitdepth=16, greyscale=True)
-        writer.write(f, disp)
+    _writePng16(disp, filepath)
 
 
-def writeDsp5File(disp, filename):
+def writeDsp5File(disp, filename, preset=None, **options):
+    """write disparity to a dsp5 (hdf5) file as used in the Spring dataset (Mehl et al., 2023).
+    disp: disparity with shape height x width
+    filename: path to file where to write to
+    preset: optional name of a storage preset, see HDF5_PRESETS
+    options: storage options overriding the preset, see _createHdf5Dataset
+    """
     with h5py.File(filename, "w") as f:
-        f.create_dataset("disparity", data=disp, compression="gzip", compression_opts=5)
+        _createHdf5Dataset(f, "disparity", disp, preset, options)
 
 
-def readDsp5Disp(filename):
+def readDsp5Disp(filename, region=None, stride=1, dtype=np.float32):
     with h5py.File(filename, "r") as f:
         if "disparity" not in f.keys():
             raise IOError(f"File {filename} does not have a 'disparity' key. Is this a valid dsp5 file?")
-        return f["disparity"][()]
+        return _readHdf5Dataset(f["disparity"], region, stride, dtype)
+
+
+def _createHdf5Dataset(f, key, data, preset=None, options=None):
+    """create a dataset in an open hdf5 file using the storage options of flo5/dsp5 files.
+    f: h5py.File opened for writing
+    key: dataset name
+    data: array to store, the first two axes are height and width
+    preset: optional name of a storage preset in HDF5_PRESETS
+    options: dictionary overriding the preset/default values of
+        chunks: True (automatic), None (contiguous storage) or a tile shape (tile_height, tile_width)
+        compression: None/"none", "lzf" or "gzip"
+        compression_opts: gzip level 0-9
+        shuffle: enable the byte shuffle filter (improves compression of floats)
+        dtype: storage type, e.g. "float32" or "float16" (lossy). None keeps the type of data
+    returns: the h5py dataset
+    """
+    return f.create_dataset(key, data=data, **_hdf5StorageArgs(data.shape, preset, options))
+
+
+def _hdf5StorageArgs(shape, preset=None, options=None):
+    """translate a storage preset and options (see _createHdf5Dataset) into arguments for h5py create_dataset.
+    shape: shape of the stored array, the first two axes are height and width
+    returns: dictionary with the keys dtype, chunks, compression, compression_opts and shuffle
+    """
+    if preset is not None and preset not in HDF5_PRESETS:
+        raise ValueError(f"Unknown hdf5 preset {preset}. Please choose one of: " + ", ".join(HDF5_PRESETS))
+
+    settings = dict(HDF5_DEFAULT_OPTIONS)
+    if preset is not None:
+        settings.update(HDF5_PRESETS[preset])
+    if options:
+        unknown = set(options) - set(HDF5_DEFAULT_OPTIONS)
+        if unknown:
+            raise ValueError(f"Unknown hdf5 storage options: {', '.join(sorted(unknown))}")
+        settings.update(options)
+
+    compression = settings["compression"]
+    if compression == "none":
+        compression = None
+    compression_opts = settings["compression_opts"] if compression == "gzip" else None
+
+    chunks = settings["chunks"]
+    if isinstance(chunks, (tuple, list)):
+        # the tile covers all remaining axes (e.g. both flow components)
+        chunks = tuple(min(c, n) for c, n in zip(chunks, shape[:2])) + tuple(shape[2:])
+    if chunks is None and (compression is not None or settings["shuffle"]):
+        # filters require chunked storage
+        chunks = True
+
+    return {"dtype": settings["dtype"], "chunks": chunks, "compression": compression,
+            "compression_opts": compression_opts, "shuffle": settings["shuffle"]}
+
+
+def _readHdf5Dataset(dataset, region=None, stride=1, dtype=np.float32):
+    """read a flo5/dsp5 dataset, converting it to dtype while reading (e.g. float16 storage to float32).
+    dataset: h5py dataset
+    region: optional tuple (y0, y1, x0, x1), read with a hyperslab selection
+    stride: only every stride-th row and column (of the region) is read
+    dtype: type of the returned array, None keeps the stored type
+    returns: numpy array
+    """
+    if dtype is not None and dataset.dtype != dtype:
+        dataset = dataset.astype(dtype)
+    if region is None and stride == 1:
+        return dataset[()]
+    # hyperslab selection, only the selected part is read and decompressed
+    return dataset[_regionSlices(region, stride)]
+
+
+class FlowSequenceFile:
+    """container storing a whole sequence of flow fields in a single hdf5 file (conventionally *.flo5seq).
+    The file holds the datasets "flow" (N x height x width x 2) and optionally "valid" (N x height x width, bool)
+    and "disparity" (N x height x width). Every frame is stored in its own chunks, so single frames (or regions of
+    them) can be read without touching the rest of the sequence, and frames can be appended to existing files.
+
+    with FlowSequenceFile("alley_1.flo5seq", "w") as seq:
+        for flow in flows:
+            seq.append(flow)
+
+    with FlowSequenceFile("alley_1.flo5seq") as seq:
+        flow = seq[10]
+    """
+
+    def __init__(self, filename, mode="r", preset=None, **options):
+        """open a sequence file.
+        filename: path to the sequence file
+        mode: "r" (read), "w" (create/overwrite) or "a" (read and append)
+        preset, options: storage options used when the datasets are created, see _createHdf5Dataset.
+            A tile shape given as chunks splits every frame into tiles, otherwise one chunk holds one frame.
+        """
+        if mode not in ["r", "w", "a"]:
+            raise ValueError(f"FlowSequenceFile: mode must be r, w or a, got {mode}")
+        self.filename = filename
+        self.preset = preset
+        self.options = options
+        self._file = h5py.File(filename, mode)
+        if mode != "w" and len(self._file.keys()) > 0 and "flow" not in self._file.keys():
+            self._file.close()
+            raise IOError(f"File {filename} does not have a 'flow' key. Is this a valid flow sequence file?")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        if "flow" not in self._file.keys():
+            return 0
+        return self._file["flow"].shape[0]
+
+    def __getitem__(self, index):
+        return self.readFlow(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.readFlow(i)
+
+    def close(self):
+        self._file.close()
+
+    def hasValid(self):
+        return "valid" in self._file.keys()
+
+    def hasDisp(self):
+        return "disparity" in self._file.keys()
+
+    def readFlow(self, index, region=None, stride=1, dtype=np.float32):
+        """read the flow of frame index with shape height x width x 2 (see readFlowFile for region, stride and dtype)"""
+        return self._readFrame("flow", index, region, stride, dtype)
+
+    def readValid(self, index, region=None, stride=1):
+        """read the boolean valid mask of frame index with shape height x width"""
+        return self._readFrame("valid", index, region, stride, None)
+
+    def readDisp(self, index, region=None, stride=1, dtype=np.float32):
+        """read the disparity of frame index with shape height x width"""
+        return self._readFrame("disparity", index, region, stride, dtype)
+
+    def append(self, flow, valid=None, disp=None):
+        """append a frame to the sequence.
+        flow: optical flow with shape height x width x 2
+        valid: optional boolean valid mask with shape height x width
+        disp: optional disparity with shape height x width
+        Valid masks and disparities are either given for all frames of a sequence or for none.
+        """
+        if len(flow.shape) != 3 or flow.shape[2] != 2:
+            raise IOError(f"FlowSequenceFile {self.filename}: expected shape height x width x 2 but received {flow.shape}")
+
+        n = len(self)
+        frame = {"flow": flow, "valid": valid, "disparity": disp}
+
+        # check everything before writing, so a rejected frame leaves the file unchanged
+        for key, data in frame.items():
+            if key not in self._file.keys():
+                if data is not None and n > 0:
+                    raise IOError(f"FlowSequenceFile {self.filename}: '{key}' was not given for the previous frames")
+            elif data is None:
+                raise IOError(f"FlowSequenceFile {self.filename}: '{key}' missing, it was given for the previous frames")
+            elif self._file[key].shape[1:] != data.shape:
+                raise IOError(f"FlowSequenceFile {self.filename}: expected '{key}' shape {self._file[key].shape[1:]} but received {data.shape}")
+        if valid is not None and valid.shape != flow.shape[:2]:
+            raise IOError(f"FlowSequenceFile {self.filename}: valid mask shape {valid.shape} does not fit flow shape {flow.shape}")
+        if disp is not None and disp.shape != flow.shape[:2]:
+            raise IOError(f"FlowSequenceFile {self.filename}: disparity shape {disp.shape} does not fit flow shape {flow.shape}")
+
+        for key, data in frame.items():
+            if data is None:
+                continue
+            if key not in self._file.keys():
+                self._createFrameDataset(key, data)
+            dataset = self._file[key]
+            dataset.resize(n + 1, axis=0)
+            dataset[n] = data
+
+    def _createFrameDataset(self, key, data):
+        if key == "valid":
+            args = {"dtype": bool, "chunks": True, "compression": "gzip", "compression_opts": 1, "shuffle": False}
+        else:
+            args = _hdf5StorageArgs(data.shape, self.preset, self.options)
+            if args["dtype"] is None:
+                args["dtype"] = data.dtype
+
+        frame_chunks = args["chunks"]
+        if not isinstance(frame_chunks, tuple):
+            frame_chunks = data.shape
+        args["chunks"] = (1,) + frame_chunks
+
+        self._file.create_dataset(key, shape=(0,) + data.shape, maxshape=(None,) + data.shape, **args)
+
+    def _readFrame(self, key, index, region, stride, dtype):
+        if key not in self._file.keys():
+            raise IOError(f"FlowSequenceFile {self.filename}: file does not contain '{key}'")
+        dataset = self._file[key]
+        if index < 0:
+            index += dataset.shape[0]
+        if index < 0 or index >= dataset.shape[0]:
+            raise IndexError(f"FlowSequenceFile {self.filename}: frame {index} out of range")
+        if dtype is not None and dataset.dtype != dtype:
+            dataset = dataset.astype(dtype)
+        return dataset[(index,) + _regionSlices(region, stride)]
+
+
+def _regionSlices(region, stride):
+    """convert a region (y0, y1, x0, x1) and a stride into slices for the first two (height and width) axes
+    region: tuple (y0, y1, x0, x1) or None for the whole field
+    stride: step between the selected rows and columns
+    returns: tuple of two slices
+    """
+    if stride < 1:
+        raise ValueError(f"stride must be positive, got {stride}")
+    if region is None:
+        return slice(None, None, stride), slice(None, None, stride)
+    y0, y1, x0, x1 = region
+    return slice(y0, y1, stride), slice(x0, x1, stride)
+
+
+def _cropArray(data, region, stride):
+    """select a region (see _regionSlices) of an array that has already been read.
+    returns: the array itself if nothing is cropped, otherwise a copy of the selected part
+    """
+    if region is None and stride == 1:
+        return data
+    return np.array(data[_regionSlices(region, stride)])
 
 
 def writeDispFile(disp, filepath):
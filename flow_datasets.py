@@ -4,6 +4,10 @@ import flow_IO
 import flow_errors
 import numpy as np
 import multiprocessing
+import threading
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 
 SUPPORTED_DATASETS = ["middlebury", "kitti12", "kitti15", "mpi_sintel"]
@@ -275,6 +279,190 @@ def testDatasetCompleteness(dataset):
                 print("Image file does not exist", img)
 
 
+def validateDataset(dataset, workers=None, verbose=True):
+    """
+    Check all flow and image files of a dataset by reading only their headers (see flow_IO.probeFlowFile).
+    Detects missing files, unreadable headers, truncated files and flows whose size differs from the images of the sequence.
+    dataset: dataset dictionary containing flow and image paths
+    workers: number of threads used to probe the files, defaults to the number of CPUs
+    verbose: if True, print every problem
+    returns: list of tuples (filepath, problem description)
+    """
+    def probe(filepath):
+        if not os.path.exists(filepath):
+            return None, "file does not exist"
+        try:
+            info = flow_IO.probeFlowFile(filepath)
+        except Exception as e:
+            return None, f"header could not be read: {e}"
+        if info["expected_size"] is not None and info["file_size"] != info["expected_size"]:
+            return info, f"file has {info['file_size']} bytes, expected {info['expected_size']} bytes"
+        return info, None
+
+    paths = []
+    for _, content in dataset.items():
+        paths.extend(content["images"])
+        paths.extend(content["flows"])
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        probes = dict(zip(paths, pool.map(probe, paths)))
+
+    problems = []
+    for _, content in dataset.items():
+        size = None
+        for filepath in content["images"] + content["flows"]:
+            info, problem = probes[filepath]
+            if problem is None:
+                if size is None:
+                    size = (info["height"], info["width"])
+                elif size != (info["height"], info["width"]):
+                    problem = f"size {info['height']}x{info['width']} does not match {size[0]}x{size[1]} of the sequence"
+            if problem is not None:
+                problems.append((filepath, problem))
+
+    if verbose:
+        for filepath, problem in problems:
+            print(filepath, problem)
+    return problems
+
+
+def convertDatasetToSequences(dataset, outdir, store_valid=True, preset=None, **options):
+    """Convert the flow files of a dataset into one flow sequence file (see flow_IO.FlowSequenceFile) per sequence.
+    dataset: dataset dictionary containing flow and image paths, e.g. from getTrainDataset
+    outdir: folder where the sequence files <sequence>.flo5seq are written to
+    store_valid: if True, also store the valid masks (pixels where the groundtruth is not nan)
+    preset, options: hdf5 storage options, see flow_IO._createHdf5Dataset
+    returns: dictionary mapping the sequence names to the written file paths
+    """
+    os.makedirs(outdir, exist_ok=True)
+
+    result = {}
+    for sequence, content in dataset.items():
+        if len(content["flows"]) == 0:
+            continue
+        filepath = os.path.join(outdir, sequence + ".flo5seq")
+        with flow_IO.FlowSequenceFile(filepath, "w", preset=preset, **options) as seq:
+            for flowpath in content["flows"]:
+                flow = flow_IO.readFlowFile(flowpath)
+                valid = None
+                if store_valid:
+                    valid = ~(np.isnan(flow[:, :, 0]) | np.isnan(flow[:, :, 1]))
+                seq.append(flow, valid=valid)
+        result[sequence] = filepath
+    return result
+
+
+class GroundtruthCache:
+    """Cache for decoded groundtruth files with a memory tier and an optional disk tier.
+    The memory tier keeps the most recently used arrays up to a memory budget and a maximum number of entries
+    (least recently used entries are evicted). The entry limit bounds the number of open files of memory-mapped entries.
+    The disk tier stores decoded arrays as raw npy files that are memory-mapped on access, so they are shared between
+    processes and runs. Entries are keyed by file path, modification time and size, so changed files are decoded again;
+    stale disk entries are not deleted automatically.
+    Returned arrays are read-only, since they are shared between all callers.
+    """
+
+    def __init__(self, max_bytes=1024**3, cache_dir=None, max_entries=256):
+        """
+        max_bytes: memory budget of the memory tier in bytes
+        cache_dir: optional folder of the disk tier
+        max_entries: maximum number of entries of the memory tier
+        """
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def readFlow(self, filepath):
+        """read a flow file (see flow_IO.readFlowFile) through the cache"""
+        return self.read(filepath, flow_IO.readFlowFile, "flow")
+
+    def readSparseFlow(self, filepath, dtype=np.float32):
+        """read a KITTI png flow file as sparse flow (see flow_IO.readPngFlowSparse) through the cache.
+        Only the packed valid pixels are cached, which takes a fraction of the memory of the dense flow."""
+        return flow_IO.convertPngFlowSparse(self.read(filepath, flow_IO.readPngFlowSparseRaw, "sparseflow"), dtype=dtype)
+
+    def readDisp(self, filepath):
+        """read a disparity file (see flow_IO.readDispFile) through the cache"""
+        return self.read(filepath, flow_IO.readDispFile, "disp")
+
+    def read(self, filepath, reader, kind):
+        """read a file through the cache.
+        filepath: path to the file
+        reader: function decoding the file into a numpy array
+        kind: name of the decoded representation, files read with different readers need different kinds
+        returns: read-only numpy array
+        """
+        stat = os.stat(filepath)
+        key = f"{kind}|{os.path.abspath(filepath)}|{stat.st_mtime_ns}|{stat.st_size}"
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        data = None
+        disk_path = None
+        if self.cache_dir is not None:
+            disk_path = os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + ".npy")
+            if os.path.exists(disk_path):
+                data = np.load(disk_path, mmap_mode="r")
+
+        if data is None:
+            data = np.asarray(reader(filepath))
+            if disk_path is not None:
+                # write to a temporary file first, so other processes never read a partially written file
+                tmp_path = f"{disk_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    np.save(f, data)
+                os.replace(tmp_path, disk_path)
+            data.flags.writeable = False
+
+        self._store(key, data)
+        return data
+
+    def clear(self):
+        """remove all entries from the memory tier"""
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def _store(self, key, data):
+        # memory-mapped arrays count with their full size as well, so they are evicted and their file handles released
+        nbytes = data.nbytes
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = data
+            self._nbytes += nbytes
+            while self._nbytes > self.max_bytes or len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._nbytes -= evicted.nbytes
+
+
+_groundtruth_caches = {}
+
+
+def getGroundtruthCache(cache_dir=None, memory=True):
+    """Get the groundtruth cache of this process for a disk tier folder.
+    cache_dir: folder of the disk tier, or None for a cache that only uses memory
+    memory: if False, the memory tier is disabled and arrays are freed as soon as the caller drops them.
+            Short-lived processes that read every file once (e.g. the pool workers of the dataset evaluation)
+            get no hits from the memory tier, but would keep the arrays alive until they exit.
+    returns: GroundtruthCache, the same instance for every call with the same cache_dir and memory
+    """
+    key = (cache_dir, memory)
+    if key not in _groundtruth_caches:
+        _groundtruth_caches[key] = GroundtruthCache(max_bytes=1024**3 if memory else 0, cache_dir=cache_dir)
+    return _groundtruth_caches[key]
+
+
 def findGroundtruth(filepath):
     """Try to automatically find a ground truth flow file for a given filepath.
     returns: path to groundtruth flow or None if not found
@@ -309,22 +497,103 @@ def findGroundtruth(filepath):
     return None
 
 
-def getGroundTruthSF_KITTI(i):
+def _predictionPath(pred_dir, sequence, gt_path, pred_ext=None):
+    """path of the predicted flow belonging to a groundtruth flow file.
+    Predictions mirror the groundtruth layout: <pred_dir>/<sequence>/<file> if the groundtruth is stored in a
+    sequence folder (Sintel, Middlebury), otherwise <pred_dir>/<file> (KITTI).
+    """
+    filename = os.path.basename(gt_path)
+    if pred_ext is not None:
+        filename = os.path.splitext(filename)[0] + pred_ext
+    if os.path.basename(os.path.dirname(gt_path)) == sequence:
+        return os.path.join(pred_dir, sequence, filename)
+    return os.path.join(pred_dir, filename)
+
+
+def _evaluateFlowFrame(args):
+    sequence, index, pred_path, gt_path, cache_dir = args
+    flow = flow_IO.readFlowFile(pred_path)
+    if gt_path.endswith(".png"):
+        # sparse KITTI groundtruth: only the valid pixels are cached and evaluated
+        gt = getGroundtruthCache(cache_dir, memory=False).readSparseFlow(gt_path)
+        return sequence, index, flow_errors.compute_ErrorSums_sparse(flow, gt)
+    gt = getGroundtruthCache(cache_dir, memory=False).readFlow(gt_path)
+    return sequence, index, flow_errors.compute_ErrorSums(flow, gt)
+
+
+def evaluateFlowDatasetFrames(pred_dir, dataset_name, workers=None, sintel_imagetype="clean", kitti_flowtype="flow_occ", pred_ext=None, cache_dir=None):
+    """Evaluate predicted flow files against the groundtruth of a dataset on a process pool.
+    Reading and evaluation of different frames run in parallel, results are yielded as soon as a frame is done.
+    pred_dir: folder containing the predictions in the layout of the groundtruth (see _predictionPath)
+    dataset_name, sintel_imagetype, kitti_flowtype: see getTrainDataset
+    workers: number of processes, defaults to the number of CPUs
+    pred_ext: optional file extension of the predictions (e.g. ".flo5"), defaults to the groundtruth extension
+    cache_dir: optional disk tier folder of the groundtruth cache (see getGroundtruthCache)
+    returns: generator of tuples (sequence, frame index, error sums as returned by flow_errors.compute_ErrorSums)
+    """
+    dataset = getTrainDataset(dataset_name, sintel_imagetype=sintel_imagetype, kitti_flowtype=kitti_flowtype)
+
+    tasks = []
+    for sequence, content in dataset.items():
+        for index, gt_path in enumerate(content["flows"]):
+            tasks.append((sequence, index, _predictionPath(pred_dir, sequence, gt_path, pred_ext), gt_path, cache_dir))
+
+    missing = [task[2] for task in tasks if not os.path.exists(task[2])]
+    if missing:
+        raise IOError(f"{len(missing)} predicted flow files are missing, e.g. {missing[0]}")
+
+    with multiprocessing.Pool(workers) as p:
+        for result in p.imap_unordered(_evaluateFlowFrame, tasks, chunksize=4):
+            yield result
+
+
+def evaluateFlowDataset(pred_dir, dataset_name, workers=None, sintel_imagetype="clean", kitti_flowtype="flow_occ", pred_ext=None, callback=None, cache_dir=None):
+    """Evaluate predicted flow files against the groundtruth of a dataset (see evaluateFlowDatasetFrames).
+    The error sums and pixel counts are accumulated exactly, so the pixel-weighted measures equal those of
+    evaluating all pixels of the dataset at once. Frame-weighted measures average the per-frame measures;
+    frames without valid groundtruth pixels are left out of these averages.
+    callback: optional function called with (sequence, frame index, measures) whenever a frame is finished
+    cache_dir: optional disk tier folder of the groundtruth cache (see getGroundtruthCache)
+    returns: dictionary with the keys "sequences" (sequence name -> results) and "all" (results of the whole dataset).
+             Results contain "pixel" and "frame" (dictionaries with AAE, AEE, BP and Fl), "frames" and "pixels".
+    """
+    accumulators = {}
+    for sequence, index, sums in evaluateFlowDatasetFrames(pred_dir, dataset_name, workers, sintel_imagetype, kitti_flowtype, pred_ext, cache_dir):
+        measures = accumulators.setdefault(sequence, flow_errors.FlowMetricAccumulator()).add(sums)
+        if measures is not None and callback is not None:
+            callback(sequence, index, measures)
+
+    result = {"sequences": {}}
+    total = flow_errors.FlowMetricAccumulator()
+    for sequence in sorted(accumulators):
+        result["sequences"][sequence] = accumulators[sequence].result()
+        total.merge(accumulators[sequence])
+    result["all"] = total.result()
+    return result
+
+
+def getGroundTruthSF_KITTI(i, cache_dir=None, memory=True):
+    """read the KITTI 15 scene flow groundtruth of frame i through the groundtruth cache (see getGroundtruthCache).
+    cache_dir: optional disk tier folder of the groundtruth cache
+    memory: if False, only the disk tier of the cache is used
+    returns: (disp_noc_0, disp_noc_1, flow_noc), (disp_occ_0, disp_occ_1, flow_occ), obj_map
+    """
     dataset_basepath = os.getenv("DATASETS")
 
     if dataset_basepath is None:
         raise ValueError(f"DATASET environment variable not set")
 
     dataset_basepath = os.path.join(dataset_basepath, "kitti15", "training")
+    cache = getGroundtruthCache(cache_dir, memory=memory)
     # groundtruth
-    disp_noc_0 = flow_IO.readDispFile(os.path.join(dataset_basepath, "disp_noc_0", f"{i:06d}_10.png"))
-    disp_noc_1 = flow_IO.readDispFile(os.path.join(dataset_basepath, "disp_noc_1", f"{i:06d}_10.png"))
-    flow_noc = flow_IO.readFlowFile(os.path.join(dataset_basepath, "flow_noc", f"{i:06d}_10.png"))
-    disp_occ_0 = flow_IO.readDispFile(os.path.join(dataset_basepath, "disp_occ_0", f"{i:06d}_10.png"))
-    disp_occ_1 = flow_IO.readDispFile(os.path.join(dataset_basepath, "disp_occ_1", f"{i:06d}_10.png"))
-    flow_occ = flow_IO.readFlowFile(os.path.join(dataset_basepath, "flow_occ", f"{i:06d}_10.png"))
+    disp_noc_0 = cache.readDisp(os.path.join(dataset_basepath, "disp_noc_0", f"{i:06d}_10.png"))
+    disp_noc_1 = cache.readDisp(os.path.join(dataset_basepath, "disp_noc_1", f"{i:06d}_10.png"))
+    flow_noc = cache.readFlow(os.path.join(dataset_basepath, "flow_noc", f"{i:06d}_10.png"))
+    disp_occ_0 = cache.readDisp(os.path.join(dataset_basepath, "disp_occ_0", f"{i:06d}_10.png"))
+    disp_occ_1 = cache.readDisp(os.path.join(dataset_basepath, "disp_occ_1", f"{i:06d}_10.png"))
+    flow_occ = cache.readFlow(os.path.join(dataset_basepath, "flow_occ", f"{i:06d}_10.png"))
     # object map (fg/bg)
-    obj_map = flow_IO.readKITTIObjMap(os.path.join(dataset_basepath,"obj_map", f"{i:06d}_10.png"))
+    obj_map = cache.read(os.path.join(dataset_basepath,"obj_map", f"{i:06d}_10.png"), flow_IO.readKITTIObjMap, "objmap")
     return (disp_noc_0, disp_noc_1, flow_noc), (disp_occ_0, disp_occ_1, flow_occ), obj_map
 
 
@@ -338,41 +607,59 @@ def getIntrinsics_KITTI(i, mode="training", image=2):
     return flow_IO.readKITTIIntrinsics(os.path.join(dataset_basepath, "calib_cam_to_cam", f"{i:06d}.txt"), image=image)
 
 
-def evaluateSF_KITTI_seq(basepath, seqnum):
+def evaluateSF_KITTI_seq(basepath, seqnum, cache_dir=None):
+    """compute the KITTI 15 scene flow counts of one frame (see flow_errors.compute_SF_full)
+    basepath: folder containing the subfolders disp_0, disp_1 and flow with the estimated scene flow
+    seqnum: frame number
+    cache_dir: optional groundtruth cache folder (see getGroundTruthSF_KITTI)
+    returns: flat list of 2 x 3 x 8 counts
+    """
     disp_0 = flow_IO.readDispFile(os.path.join(basepath,"disp_0", f"{seqnum:06d}_10.png"))
     disp_1 = flow_IO.readDispFile(os.path.join(basepath,"disp_1", f"{seqnum:06d}_10.png"))
     flow = flow_IO.readFlowFile(os.path.join(basepath, "flow", f"{seqnum:06d}_10.png"))
-    gt_noc, gt_occ, obj_map = getGroundTruthSF_KITTI(seqnum)
+    gt_noc, gt_occ, obj_map = getGroundTruthSF_KITTI(seqnum, cache_dir=cache_dir, memory=False)
     e = flow_errors.compute_SF_full((disp_0, disp_1, flow), gt_noc, gt_occ, obj_map, return_list=True)
-    #print(e)
     return e
 
 
-def evaluateSF_KITTI(folderpath):
+def evaluateSF_KITTI(folderpath, workers=None, cache_dir=None, verbose=True):
+    """evaluate a KITTI 15 scene flow submission on the training set.
+    The error percentages are computed from the bad and valid pixel counts summed over all 200 frames,
+    as done by the official KITTI devkit.
+    folderpath: folder containing the subfolders disp_0, disp_1 and flow with the estimated scene flow
+    workers: number of processes, defaults to the number of CPUs
+    cache_dir: optional groundtruth cache folder (see getGroundTruthSF_KITTI)
+    verbose: if True, print the results as a table
+    returns: dictionary result[gt_type][area] with gt_type in noc/occ and area in bg/fg/all,
+             each containing the keys D1, D2, Fl and SF
+    """
     assert os.path.exists(os.path.join(folderpath, "disp_0"))
     assert os.path.exists(os.path.join(folderpath, "disp_1"))
     assert os.path.exists(os.path.join(folderpath, "flow"))
 
-    dataset_basepath = os.getenv("DATASETS")
-
-    if dataset_basepath is None:
-        raise ValueError(f"DATASET environment variable not set")
-
-    dataset_basepath = os.path.join(dataset_basepath, "kitti15", "training")
+    with multiprocessing.Pool(workers) as p:
+        args = [(folderpath, i, cache_dir) for i in range(200)]
+        counts = p.starmap(evaluateSF_KITTI_seq, args)
 
-    errors = []
-
-    # for i in range(200):
-    #     errors.append(evaluateSF_KITTI_seq(folderpath, i))
-
-    with multiprocessing.Pool(15) as p:
-        args = [(folderpath, i) for i in range(200)]
-        errors = p.starmap(evaluateSF_KITTI_seq, args)
+    counts = np.asarray(counts).reshape((-1, 2, 3, 8))
 
+    result = {}
+    for i, gt_type in enumerate(["noc", "occ"]):
+        result[gt_type] = {}
+        for j, area in enumerate(["bg", "fg", "all"]):
+            accumulator = flow_errors.SceneFlowAccumulator()
+            for frame_counts in counts[:, i, j]:
+                accumulator.add(frame_counts)
+            result[gt_type][area] = accumulator.result()
+
+    if verbose:
+        print("          " + "".join(f"{name:>8s}" for name in ["D1", "D2", "Fl", "SF"]))
+        for gt_type in ["noc", "occ"]:
+            for area in ["bg", "fg", "all"]:
+                values = result[gt_type][area]
+                print(f"{gt_type:>3s} {area:>3s}:  " + "".join(f"{values[name]:8.2f}" for name in ["D1", "D2", "Fl", "SF"]))
 
-    errors = np.asarray(errors)
-    errors = np.average(errors, axis=0)
-    print(errors)
+    return result
 
 
 def sf_findCorrespondingFiles(filepath):
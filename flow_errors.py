@@ -1,18 +1,21 @@
 import numpy as np
 from flow_utils import backproject_flow3d_target
 
+# the image axes of (batched) pixel-wise error maps, all metrics reduce over these and keep leading batch dimensions
+SPATIAL_AXES = (-2, -1)
+
 def compute_AAE(flow, gt):
     """compute the average angular error (AAE) in degrees between the estimated flow field and the groundtruth flow field
-    flow: estimated flow
+    flow: estimated flow, HxWx2 or with leading batch dimensions (e.g. NxHxWx2)
     gt: groundtruth flow
-    return: AAE in [deg]
+    return: AAE in [deg], one value per sample for batched input
     """
-    arg = flow[:, :, 0] * gt[:, :, 0] + flow[:, :, 1] * gt[:, :, 1] + 1
+    arg = flow[..., 0] * gt[..., 0] + flow[..., 1] * gt[..., 1] + 1
 
     # number of valid pixels:
-    count = np.count_nonzero(~np.isnan(arg))
+    count = np.count_nonzero(~np.isnan(arg), axis=SPATIAL_AXES)
 
-    arg /= np.sqrt(flow[:, :, 0]**2 + flow[:, :, 1]**2 + 1) * np.sqrt(gt[:, :, 0]**2 + gt[:, :, 1]**2 + 1)
+    arg /= np.sqrt(flow[..., 0]**2 + flow[..., 1]**2 + 1) * np.sqrt(gt[..., 0]**2 + gt[..., 1]**2 + 1)
 
     # set nan values to 1 since arccos(1)=0
     arg = np.nan_to_num(arg, nan=1.0)
@@ -23,14 +26,26 @@ def compute_AAE(flow, gt):
 
     angular_error = np.arccos(arg)
 
-    return np.sum(angular_error) / count / (2 * np.pi) * 360.0
+    return np.sum(angular_error, axis=SPATIAL_AXES) / count / (2 * np.pi) * 360.0
+
+
+def compute_AE(flow, gt):
+    """compute the angular error in degrees for every pixel location
+    flow: estimated flow
+    gt: groundtruth flow
+    return: np array with pixel-wise angular error in [deg] or nan if no groundtruth is present
+    """
+    arg = flow[..., 0] * gt[..., 0] + flow[..., 1] * gt[..., 1] + 1
+    arg /= np.sqrt(flow[..., 0]**2 + flow[..., 1]**2 + 1) * np.sqrt(gt[..., 0]**2 + gt[..., 1]**2 + 1)
+    np.clip(arg, -1.0, 1.0, out=arg)
+    return np.arccos(arg) / (2 * np.pi) * 360.0
 
 
 def compute_EE(flow, gt):
     """compute the endpoint error for every pixel location
-    flow: estimated flow
+    flow: estimated flow, HxWx2 or with leading batch dimensions (e.g. NxHxWx2)
     gt: ground truth flow
-    return: 2D np array with pixel-wise endpoint error or nan if no groundtruth is present
+    return: np array with pixel-wise endpoint error (HxW or e.g. NxHxW) or nan if no groundtruth is present
     """
     diff = np.square(flow - gt)
     comp = np.sum(diff, axis=-1)
@@ -41,14 +56,15 @@ def compute_EE(flow, gt):
 
 def compute_AEE(flow, gt, ee=None):
     """compute the average endpoint error (AEE, sometimes also EPE) between the estimated flow field and the groundtruth flow field
-    flow: estimated flow
+    flow: estimated flow, HxWx2 or with leading batch dimensions (e.g. NxHxWx2)
     gt: groundtruth flow
     ee: precomputed endpoint error
+    return: AEE, one value per sample for batched input
     """
     if ee is None:
         ee = compute_EE(flow, gt)
-    count = np.count_nonzero(~np.isnan(ee))
-    return np.nansum(ee) / count
+    count = np.count_nonzero(~np.isnan(ee), axis=SPATIAL_AXES)
+    return np.nansum(ee, axis=SPATIAL_AXES) / count
 
 
 def compute_BP(flow, gt, useKITTI15=False, ee=None, return_mask=False, t1=3.0, t2=0.05):
@@ -58,18 +74,18 @@ def compute_BP(flow, gt, useKITTI15=False, ee=None, return_mask=False, t1=3.0, t
     An extension to this definition used for the KITTI15 dataset is that a pixel is valid if
     the endpoint error is smaller than 3px OR less than 5% of the groundtruth vector length.
     This extension has an influence if the groundtruth vector length is > 60px.
-    flow: estimated flow
+    flow: estimated flow, HxWx2 or with leading batch dimensions (e.g. NxHxWx2)
     gt: groundtruth flow
     useKITTI15: boolean flag if the KITTI15 calculation method should be used (gives better results)
     ee: precomputed endpoint error
     return_mask: if True, return pixelwise boolean mask instead of aggregated number
-    return: BP error as percentage [0;100], or mask if return_mask is True
+    return: BP error as percentage [0;100] (one value per sample for batched input), or mask if return_mask is True
     """
     if ee is None:
         ee = compute_EE(flow, gt)
 
     # number of valid pixels:
-    count = np.count_nonzero(~np.isnan(ee))
+    count = np.count_nonzero(~np.isnan(ee), axis=SPATIAL_AXES)
 
     # set the ee of nan pixels to zero
     ee = np.nan_to_num(ee, nan=0.0)
@@ -86,18 +102,18 @@ def compute_BP(flow, gt, useKITTI15=False, ee=None, return_mask=False, t1=3.0, t
     if return_mask:
         return bp_mask
     else:
-        return 100 * np.sum(bp_mask) / count
+        return 100 * np.sum(bp_mask, axis=SPATIAL_AXES) / count
 
 
 def compute_Fl(flow, gt, ee=None, return_mask=False, t1=3.0, t2=0.05):
     """compute the bad pixel error (Fl) between the estimated flow field and the groundtruth flow field.
     The bad pixel error is defined as the percentage of valid pixels.
     Valid pixel are defined as those whose endpoint is smaller than 3px OR less than 5% of the groundtruth vector length.
-    flow: estimated flow
+    flow: estimated flow, HxWx2 or with leading batch dimensions (e.g. NxHxWx2)
     gt: groundtruth flow
     ee: precomputed endpoint error
     return_mask: if True, return pixelwise boolean mask instead of aggregated number
-    return: Fl error as percentage [0;100], or mask if return_mask is True
+    return: Fl error as percentage [0;100] (one value per sample for batched input), or mask if return_mask is True
     """
     return compute_BP(flow, gt, useKITTI15=True, ee=ee, return_mask=return_mask, t1=t1, t2=t2)
 
@@ -111,20 +127,247 @@ def printAllErrorMeasures(flow, gt):
         print(f"{name:3s}: {err(flow,gt):.2f}")
 
 
-def getAllErrorMeasures(flow, gt):
+def getAllErrorMeasures(flow, gt, chunk_rows=None):
     """create a dictionary with the AAE, AEE, BP and Fl error measures
     flow: estimated flow
     gt: groundtruth flow
+    chunk_rows: optional number of rows processed at once (see compute_ErrorSums)
     return: dictionary with keys AAE, AEE, BP, Fl and error values
     """
-    result = {}
-    result["AAE"] = compute_AAE(flow, gt)
+    return getErrorMeasuresFromSums(compute_ErrorSums(flow, gt, chunk_rows=chunk_rows))
 
-    # precompute EE
-    ee = compute_EE(flow, gt)
-    for err, name in zip([compute_AEE, compute_BP, compute_Fl], ["AEE", "BP", "Fl"]):
-        result[name] = err(flow, gt, ee=ee)
-    return result
+
+def getErrorMeasuresFromSums(sums):
+    """compute AAE, AEE, BP and Fl from accumulated error sums (see compute_ErrorSums)
+    sums: dictionary with keys count, EE, AE, BP, Fl
+    return: dictionary with keys AAE, AEE, BP, Fl and error values
+    """
+    count = sums["count"]
+    return {
+        "AAE": sums["AE"] / count / (2 * np.pi) * 360.0,
+        "AEE": sums["EE"] / count,
+        "BP": 100 * sums["BP"] / count,
+        "Fl": 100 * sums["Fl"] / count,
+    }
+
+
+def compute_ErrorSums(flow, gt, t1=3.0, t2=0.05, chunk_rows=None):
+    """compute the sums behind the AAE, AEE, BP and Fl error measures in a single pass.
+    All pixel-wise quantities are computed in a few reused scratch buffers with the same arithmetic as
+    compute_AAE, compute_EE, compute_BP and compute_Fl, so the results match these functions.
+    flow: estimated flow
+    gt: groundtruth flow
+    t1, t2: absolute and relative thresholds of the bad pixel measures (see compute_BP)
+    chunk_rows: if given, the field is processed in blocks of chunk_rows rows, which keeps the scratch buffers in cache
+    return: dictionary with keys
+        count: number of valid pixels
+        EE: sum of the endpoint errors
+        AE: sum of the angular errors in radians
+        BP: number of pixels with an endpoint error > t1
+        Fl: number of pixels with an endpoint error > t1 and > t2 * groundtruth vector length
+    """
+    height, width = flow.shape[:2]
+    rows = height if chunk_rows is None else max(1, min(chunk_rows, height))
+    dtype = np.result_type(flow, gt, 1.0)
+
+    ee_buf = np.empty((rows, width), dtype=dtype)
+    a_buf = np.empty((rows, width), dtype=dtype)
+    b_buf = np.empty((rows, width), dtype=dtype)
+    c_buf = np.empty((rows, width), dtype=dtype)
+    nan_buf = np.empty((rows, width), dtype=bool)
+    bad_buf = np.empty((rows, width), dtype=bool)
+    rel_buf = np.empty((rows, width), dtype=bool)
+
+    sums = {"count": 0, "EE": 0, "AE": 0, "BP": 0, "Fl": 0}
+    for r0 in range(0, height, rows):
+        r1 = min(r0 + rows, height)
+        n = r1 - r0
+        fu, fv = flow[r0:r1, :, 0], flow[r0:r1, :, 1]
+        gu, gv = gt[r0:r1, :, 0], gt[r0:r1, :, 1]
+        ee, a, b, c = ee_buf[:n], a_buf[:n], b_buf[:n], c_buf[:n]
+        nan, bad, rel = nan_buf[:n], bad_buf[:n], rel_buf[:n]
+
+        # endpoint error
+        np.subtract(fu, gu, out=a)
+        np.multiply(a, a, out=a)
+        np.subtract(fv, gv, out=ee)
+        np.multiply(ee, ee, out=ee)
+        np.add(a, ee, out=ee)
+        np.sqrt(ee, out=ee)
+        np.isnan(ee, out=nan)
+        sums["count"] += nan.size - np.count_nonzero(nan)
+        np.copyto(ee, 0, where=nan)
+        sums["EE"] += np.sum(ee)
+
+        # bad pixels
+        np.greater(ee, t1, out=bad)
+        sums["BP"] += np.count_nonzero(bad)
+
+        # Fl: a keeps the squared groundtruth length for the angular error
+        np.multiply(gu, gu, out=a)
+        np.multiply(gv, gv, out=b)
+        np.add(a, b, out=a)
+        np.sqrt(a, out=b)
+        np.copyto(b, 0, where=np.isnan(b, out=rel))
+        np.multiply(b, t2, out=b)
+        np.greater(ee, b, out=rel)
+        np.logical_and(rel, bad, out=rel)
+        sums["Fl"] += np.count_nonzero(rel)
+
+        # angular error
+        np.add(a, 1, out=a)
+        np.sqrt(a, out=a)
+        np.multiply(fu, fu, out=b)
+        np.multiply(fv, fv, out=c)
+        np.add(b, c, out=b)
+        np.add(b, 1, out=b)
+        np.sqrt(b, out=b)
+        np.multiply(b, a, out=b)
+        np.multiply(fu, gu, out=ee)
+        np.multiply(fv, gv, out=c)
+        np.add(ee, c, out=ee)
+        np.add(ee, 1, out=ee)
+        np.divide(ee, b, out=ee)
+        np.copyto(ee, 1.0, where=np.isnan(ee, out=nan))
+        np.clip(ee, -1.0, 1.0, out=ee)
+        np.arccos(ee, out=ee)
+        sums["AE"] += np.sum(ee)
+
+    return sums
+
+
+def compute_ErrorSums_sparse(flow, gt, t1=3.0, t2=0.05):
+    """compute the error sums (see compute_ErrorSums) only at the pixels of a sparse groundtruth
+    flow: estimated flow with shape height x width x 2
+    gt: sparse groundtruth flow (see flow_IO.SparseFlow)
+    t1, t2: absolute and relative thresholds of the bad pixel measures (see compute_BP)
+    return: dictionary with keys count, EE, AE, BP, Fl
+    """
+    if tuple(flow.shape[:2]) != tuple(gt.shape):
+        raise ValueError(f"flow of shape {flow.shape} does not match the sparse groundtruth of shape {tuple(gt.shape)}")
+    y, x = np.divmod(gt.indices, gt.shape[1])
+    # the gathered pixels form a 1 x N flow field
+    return compute_ErrorSums(flow[y, x][np.newaxis], gt.values[np.newaxis], t1=t1, t2=t2)
+
+
+def getAllErrorMeasures_sparse(flow, gt):
+    """create a dictionary with the AAE, AEE, BP and Fl error measures evaluated only at the pixels of a sparse groundtruth
+    flow: estimated flow
+    gt: sparse groundtruth flow (see flow_IO.SparseFlow)
+    return: dictionary with keys AAE, AEE, BP, Fl and error values
+    """
+    return getErrorMeasuresFromSums(compute_ErrorSums_sparse(flow, gt))
+
+
+class ErrorHistogram:
+    """Accumulates endpoint errors (EE) and angular errors (AE, in degrees) of many frames in fixed-edge histograms.
+    Percentiles, the median and curves of the percentage of pixels below a threshold can be derived for a whole
+    dataset without keeping the pixel-wise errors. Histograms with the same edges can be merged exactly, e.g. the
+    histograms of several workers.
+    Bin i counts the errors in (edges[i-1], edges[i]]; bin 0 counts errors <= edges[0] and the last bin errors > edges[-1].
+    Therefore the percentage of errors above an edge is exact (e.g. equals compute_BP for t1=3.0 if 3.0 is an edge),
+    values between edges and percentiles are linearly interpolated within their bin.
+    """
+
+    def __init__(self, ee_edges=None, ae_edges=None):
+        """
+        ee_edges: increasing bin edges for the endpoint error, defaults to 0 to 100px in steps of 0.01px
+        ae_edges: increasing bin edges for the angular error, defaults to 0 to 180deg in steps of 0.01deg
+        """
+        if ee_edges is None:
+            ee_edges = np.linspace(0, 100, 10001)
+        if ae_edges is None:
+            ae_edges = np.linspace(0, 180, 18001)
+        self.edges = {"EE": np.asarray(ee_edges, dtype=np.float64), "AE": np.asarray(ae_edges, dtype=np.float64)}
+        self.counts = {kind: np.zeros(len(edges) + 1, dtype=np.int64) for kind, edges in self.edges.items()}
+
+    @property
+    def count(self):
+        """number of accumulated valid pixels"""
+        return int(self.counts["EE"].sum())
+
+    def update(self, flow, gt, ee=None):
+        """add the errors of a frame
+        flow: estimated flow
+        gt: groundtruth flow
+        ee: optional precomputed endpoint error
+        """
+        if ee is None:
+            ee = compute_EE(flow, gt)
+        ae = compute_AE(flow, gt)
+        for kind, errors in [("EE", ee), ("AE", ae)]:
+            errors = errors[~np.isnan(errors)]
+            self.counts[kind] += np.bincount(_histogramBins(errors, self.edges[kind]), minlength=len(self.counts[kind]))
+
+    def merge(self, other):
+        """add the counts of another histogram with the same edges"""
+        for kind in self.edges:
+            if not np.array_equal(self.edges[kind], other.edges[kind]):
+                raise ValueError(f"ErrorHistogram.merge: {kind} bin edges differ")
+            self.counts[kind] += other.counts[kind]
+        return self
+
+    def percentageAbove(self, thresholds, kind="EE"):
+        """percentage of pixels with an error > threshold, e.g. the bad pixel error (compute_BP) for kind "EE"
+        thresholds: scalar or array of thresholds
+        kind: "EE" or "AE"
+        return: percentage [0;100] for every threshold
+        """
+        return 100.0 - self.percentageBelow(thresholds, kind)
+
+    def percentageBelow(self, thresholds, kind="EE"):
+        """percentage of pixels with an error <= threshold, for an array of thresholds this is the cumulative error curve
+        thresholds: scalar or array of thresholds
+        kind: "EE" or "AE"
+        return: percentage [0;100] for every threshold
+        """
+        edges = self.edges[kind]
+        cumulative = np.cumsum(self.counts[kind][:-1])
+        # piecewise linear cumulative distribution, exact at the edges
+        result = np.interp(thresholds, edges, cumulative, left=0)
+        return 100.0 * result / self.count
+
+    def percentile(self, q, kind="EE"):
+        """q-th percentile of the errors, linearly interpolated within the bin containing it.
+        Percentiles falling into the first bin return the first edge, those above the last edge return the last edge.
+        q: scalar or array of percentiles in [0;100]
+        kind: "EE" or "AE"
+        """
+        edges = self.edges[kind]
+        cumulative = np.cumsum(self.counts[kind][:-1])
+        target = np.asarray(q, dtype=np.float64) / 100.0 * self.count
+        # bin k with cumulative[k-1] < target <= cumulative[k]; q=0 falls into the first non-empty bin
+        k = np.maximum(np.searchsorted(cumulative, target, side="left"), np.searchsorted(cumulative, 0, side="right"))
+        inner = (k > 0) & (k < len(edges))
+        lo = np.clip(k - 1, 0, len(edges) - 1)
+        hi = np.clip(k, 0, len(edges) - 1)
+        # cumulative[hi] > cumulative[lo] for inner bins, the fraction of the other bins is unused
+        fraction = (target - cumulative[lo]) / np.maximum(cumulative[hi] - cumulative[lo], 1)
+        return np.where(inner, edges[lo] + fraction * (edges[hi] - edges[lo]), edges[hi])[()]
+
+    def median(self, kind="EE"):
+        """median of the errors (see percentile)"""
+        return self.percentile(50, kind)
+
+
+def _histogramBins(values, edges):
+    """bin index of every value, identical to np.searchsorted(edges, values, side="left").
+    For uniformly spaced edges the index is computed arithmetically and corrected at the bin borders.
+    """
+    n = len(edges)
+    width = (edges[-1] - edges[0]) / (n - 1) if n > 1 else 0
+    if width <= 0 or not np.allclose(np.diff(edges), width, rtol=1e-9, atol=0):
+        return np.searchsorted(edges, values, side="left")
+
+    idx = np.ceil((values - edges[0]) / width)
+    np.clip(idx, 0, n, out=idx)
+    idx = idx.astype(np.intp)
+    # rounding can move values lying (almost) on an edge into a neighbouring bin
+    down = (idx > 0) & (values <= edges[np.maximum(idx - 1, 0)])
+    idx[down] -= 1
+    up = (idx < n) & (values > edges[np.minimum(idx, n - 1)])
+    idx[up] += 1
+    return idx
 
 
 def getAllErrorMeasures_area(flow, gt, area):
@@ -134,37 +377,333 @@ def getAllErrorMeasures_area(flow, gt, area):
     area: boolean array determining the evaluation area
     return: dictionary with keys AAE, AEE, BP, Fl and error values
     """
-    gt_area = gt.copy()
-    gt_area[np.invert(area)] = np.nan
-    return getAllErrorMeasures(flow, gt_area)
+    labels = np.where(area, 0, -1)
+    return getAllErrorMeasures_labels(flow, gt, labels, ["area"])["area"]
+
+
+def compute_ErrorMaps(flow, gt, t1=3.0, t2=0.05):
+    """compute the pixel-wise quantities behind the AAE, AEE, BP and Fl error measures once,
+    so that they can be reduced over arbitrary groups of pixels (see compute_ErrorSums_labels)
+    flow: estimated flow
+    gt: groundtruth flow
+    t1, t2: absolute and relative thresholds of the bad pixel measures (see compute_BP)
+    return: dictionary with keys
+        valid: boolean mask of the pixels with groundtruth
+        EE: endpoint error, 0 for invalid pixels
+        AE: angular error in radians, 0 for invalid pixels
+        BP: boolean mask of the pixels with an endpoint error > t1
+        Fl: boolean mask of the pixels with an endpoint error > t1 and > t2 * groundtruth vector length
+    """
+    ee = compute_EE(flow, gt)
+    valid = ~np.isnan(ee)
+    np.copyto(ee, 0, where=~valid)
+    bp = ee > t1
+    gt_len = np.sqrt(gt[..., 0]**2 + gt[..., 1]**2)
+    fl = bp & (ee > np.nan_to_num(gt_len, nan=0.0) * t2)
+
+    arg = flow[..., 0] * gt[..., 0] + flow[..., 1] * gt[..., 1] + 1
+    arg /= np.sqrt(flow[..., 0]**2 + flow[..., 1]**2 + 1) * np.sqrt(gt_len**2 + 1)
+    arg = np.clip(np.nan_to_num(arg, nan=1.0), -1.0, 1.0)
+    return {"valid": valid, "EE": ee, "AE": np.arccos(arg), "BP": bp, "Fl": fl}
+
+
+def compute_ErrorSums_labels(flow, gt, labels, num_labels=None, t1=3.0, t2=0.05, maps=None):
+    """compute the error sums (see compute_ErrorSums) for every label of a label map with grouped reductions
+    flow: estimated flow
+    gt: groundtruth flow
+    labels: integer array with the shape of the flow field without the last axis; pixels with negative labels are ignored
+    num_labels: number of labels, defaults to labels.max() + 1
+    t1, t2: absolute and relative thresholds of the bad pixel measures (see compute_BP)
+    maps: precomputed pixel-wise quantities (see compute_ErrorMaps)
+    return: dictionary with keys count, EE, AE, BP, Fl and an array of length num_labels as values
+    """
+    if maps is None:
+        maps = compute_ErrorMaps(flow, gt, t1=t1, t2=t2)
+    labels = np.asarray(labels)
+    if labels.shape != maps["valid"].shape:
+        raise ValueError(f"labels of shape {labels.shape} do not match the flow field of shape {maps['valid'].shape}")
+    if num_labels is None:
+        num_labels = int(labels.max()) + 1 if labels.size else 0
+
+    select = maps["valid"] & (labels >= 0) & (labels < num_labels)
+    groups = labels[select]
+    sums = {"count": np.bincount(groups, minlength=num_labels)}
+    for key in ["EE", "AE"]:
+        sums[key] = np.bincount(groups, weights=maps[key][select], minlength=num_labels)
+    for key in ["BP", "Fl"]:
+        sums[key] = np.bincount(groups[maps[key][select]], minlength=num_labels)
+    return sums
+
+
+def getAllErrorMeasures_labels(flow, gt, labels, names, t1=3.0, t2=0.05, maps=None):
+    """compute all error measures for every label of a label map in a single pass
+    flow: estimated flow
+    gt: groundtruth flow
+    labels: integer array with the shape of the flow field without the last axis; pixels with negative labels are ignored
+    names: name of every label 0, 1, ...
+    t1, t2: absolute and relative thresholds of the bad pixel measures (see compute_BP)
+    maps: precomputed pixel-wise quantities (see compute_ErrorMaps)
+    return: dictionary with the names as keys and dictionaries with keys AAE, AEE, BP, Fl as values;
+            the error values of labels without valid pixels are nan
+    """
+    sums = compute_ErrorSums_labels(flow, gt, labels, num_labels=len(names), t1=t1, t2=t2, maps=maps)
+    result = {}
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for i, name in enumerate(names):
+            result[name] = getErrorMeasuresFromSums({key: value[i] for key, value in sums.items()})
+    return result
+
+
+def getSintelStrata(gt, occ=None, boundary_dist=None):
+    """create the label maps of the standard MPI Sintel evaluation strata
+    gt: groundtruth flow, defines the speed strata s0-10, s10-40 and s40+ (groundtruth vector length in px)
+    occ: optional boolean occlusion mask, defines the strata noc and occ
+    boundary_dist: optional distance to the nearest motion boundary in px, defines the strata d0-10, d10-60 and d60-140
+    return: dictionary with the stratifications speed, occlusion and boundary as keys and tuples (labels, names) as values
+    """
+    strata = {}
+    speed = np.sqrt(gt[..., 0]**2 + gt[..., 1]**2)
+    strata["speed"] = (_binLabels(speed, [0, 10, 40, np.inf]), ["s0-10", "s10-40", "s40+"])
+    if occ is not None:
+        strata["occlusion"] = (np.asarray(occ, dtype=bool).astype(np.intp), ["noc", "occ"])
+    if boundary_dist is not None:
+        strata["boundary"] = (_binLabels(boundary_dist, [0, 10, 60, 140]), ["d0-10", "d10-60", "d60-140"])
+    return strata
+
+
+def _binLabels(values, edges):
+    """label of the half-open bin [edges[i], edges[i+1]) of every value, -1 outside of the edges or for nan;
+    the last bin includes its upper edge"""
+    labels = np.searchsorted(edges, values, side="right") - 1
+    labels[values == edges[-1]] = len(edges) - 2
+    labels[(labels >= len(edges) - 1) | np.isnan(values)] = -1
+    return labels
+
+
+def getAllErrorMeasures_strata(flow, gt, strata, t1=3.0, t2=0.05):
+    """compute all error measures for all pixels and for every stratum in a single pass.
+    The pixel-wise errors are computed once and reduced per stratum with grouped sums.
+    flow: estimated flow
+    gt: groundtruth flow
+    strata: dictionary with tuples (labels, names) as values (see getSintelStrata and getAllErrorMeasures_labels)
+    t1, t2: absolute and relative thresholds of the bad pixel measures (see compute_BP)
+    return: dictionary with the stratum names and "all" as keys and dictionaries with keys AAE, AEE, BP, Fl as values
+    """
+    maps = compute_ErrorMaps(flow, gt, t1=t1, t2=t2)
+    result = {"all": getAllErrorMeasures_labels(flow, gt, np.zeros(maps["valid"].shape, dtype=np.intp), ["all"], maps=maps)["all"]}
+    for labels, names in strata.values():
+        result.update(getAllErrorMeasures_labels(flow, gt, labels, names, maps=maps))
+    return result
 
 
-def compute_SF(disp0, disp1, flow, gt_disp0, gt_disp1, gt_flow, t1=3.0, t2=0.05):
+def compute_SF(disp0, disp1, flow, gt_disp0, gt_disp1, gt_flow, t1=3.0, t2=0.05, area=None):
+    """compute the number of bad pixels and valid pixels of the KITTI 15 scene flow measures D1, D2, Fl and SF
+    disp0, disp1, flow: estimated disparity of the first and second frame and estimated flow,
+        HxW / HxWx2 or with leading batch dimensions (e.g. NxHxW / NxHxWx2)
+    gt_disp0, gt_disp1, gt_flow: groundtruth
+    t1, t2: absolute and relative thresholds (see compute_BP)
+    area: optional boolean array restricting the evaluation to a certain area of pixels (e.g. foreground objects)
+    return: d1_badcount, d1_pxcount, d2_badcount, d2_pxcount, fl_badcount, fl_pxcount, sf_badcount, sf_pxcount,
+        each with one value per sample for batched input
+    """
     disp0_mask = compute_DisparityError(disp0, gt_disp0, return_mask=True, t1=t1, t2=t2)
     disp1_mask = compute_DisparityError(disp1, gt_disp1, return_mask=True, t1=t1, t2=t2)
     flow_mask = compute_Fl(flow, gt_flow, return_mask=True, t1=t1, t2=t2)
 
-    valid = (~np.isnan(gt_disp0)) & (~np.isnan(gt_disp1)) & (~np.isnan(gt_flow[:,:,0])) & (~np.isnan(gt_flow[:,:,1]))
+    d1_valid = ~np.isnan(gt_disp0)
+    d2_valid = ~np.isnan(gt_disp1)
+    fl_valid = ~(np.isnan(gt_flow[..., 0]) | np.isnan(gt_flow[..., 1]))
+    if area is not None:
+        disp0_mask = disp0_mask & area
+        disp1_mask = disp1_mask & area
+        flow_mask = flow_mask & area
+        d1_valid &= area
+        d2_valid &= area
+        fl_valid &= area
+
+    valid = d1_valid & d2_valid & fl_valid
     sf_mask = disp0_mask | disp1_mask | flow_mask
     sf_mask[~valid] = False
 
-    d1_badcount = disp0_mask.sum()
-    d1_pxcount = np.count_nonzero(~np.isnan(gt_disp0))
-    d2_badcount = disp1_mask.sum()
-    d2_pxcount = np.count_nonzero(~np.isnan(gt_disp1))
-    fl_badcount = flow_mask.sum()
-    fl_pxcount = np.count_nonzero(~(np.isnan(gt_flow[:,:,0]) | np.isnan(gt_flow[:,:,1])))
-    sf_badcount = sf_mask.sum()
-    sf_pxcount = np.count_nonzero(valid)
+    d1_badcount = disp0_mask.sum(axis=SPATIAL_AXES)
+    d1_pxcount = np.count_nonzero(d1_valid, axis=SPATIAL_AXES)
+    d2_badcount = disp1_mask.sum(axis=SPATIAL_AXES)
+    d2_pxcount = np.count_nonzero(d2_valid, axis=SPATIAL_AXES)
+    fl_badcount = flow_mask.sum(axis=SPATIAL_AXES)
+    fl_pxcount = np.count_nonzero(fl_valid, axis=SPATIAL_AXES)
+    sf_badcount = sf_mask.sum(axis=SPATIAL_AXES)
+    sf_pxcount = np.count_nonzero(valid, axis=SPATIAL_AXES)
 
     return d1_badcount, d1_pxcount, d2_badcount, d2_pxcount, fl_badcount, fl_pxcount, sf_badcount, sf_pxcount
 
 
+def compute_SF_full(estimate, gt_noc, gt_occ, obj_map, return_list=False, t1=3.0, t2=0.05):
+    """compute the KITTI 15 scene flow bad/valid pixel counts (see compute_SF) for the non-occluded (noc) and
+    all (occ) groundtruth pixels, each for background (bg), foreground (fg) and all pixels.
+    estimate: tuple (disp0, disp1, flow) of the estimated scene flow
+    gt_noc: tuple (disp0, disp1, flow) of the non-occluded groundtruth
+    gt_occ: tuple (disp0, disp1, flow) of the groundtruth of all pixels
+    obj_map: boolean array, True for foreground objects
+    return_list: if True, return a flat list of 2 x 3 x 8 counts in the order noc/occ, bg/fg/all, compute_SF counts
+    return: dictionary counts[gt_type][area] with the 8 counts of compute_SF, or a flat list if return_list is True
+    """
+    areas = {"bg": ~obj_map, "fg": obj_map, "all": None}
+    result = {}
+    for gt_type, gt in [("noc", gt_noc), ("occ", gt_occ)]:
+        result[gt_type] = {name: compute_SF(*estimate, *gt, t1=t1, t2=t2, area=area) for name, area in areas.items()}
+
+    if return_list:
+        return [count for gt_type in ["noc", "occ"] for name in areas for count in result[gt_type][name]]
+    return result
+
+
+def getSFMeasuresFromCounts(counts):
+    """compute the D1, D2, Fl and SF error percentages from (accumulated) compute_SF counts
+    counts: d1_badcount, d1_pxcount, d2_badcount, d2_pxcount, fl_badcount, fl_pxcount, sf_badcount, sf_pxcount
+    return: dictionary with keys D1, D2, Fl, SF and error percentages
+    """
+    result = {}
+    for i, name in enumerate(["D1", "D2", "Fl", "SF"]):
+        badcount, pxcount = counts[2 * i], counts[2 * i + 1]
+        result[name] = 100 * badcount / pxcount if pxcount > 0 else np.nan
+    return result
+
+
+class FlowMetricAccumulator:
+    """Accumulates the AAE, AEE, BP and Fl error measures over a stream of frames in constant memory.
+    Only the error sums (see compute_ErrorSums) and the sums of the per-frame measures are kept, so the
+    pixel-weighted result equals evaluating all pixels at once and the frame-weighted result averages the
+    per-frame measures. Accumulators of different processes or nodes can be combined with merge.
+    """
+
+    def __init__(self, t1=3.0, t2=0.05):
+        """
+        t1, t2: absolute and relative thresholds of the bad pixel measures (see compute_BP)
+        """
+        self.t1 = t1
+        self.t2 = t2
+        self.sums = {"count": 0, "EE": 0, "AE": 0, "BP": 0, "Fl": 0}
+        self.frame_sums = {"AAE": 0, "AEE": 0, "BP": 0, "Fl": 0}
+        self.frames = 0
+
+    def update(self, flow, gt, mask=None):
+        """add a frame, or every sample of a batch with leading batch dimensions (e.g. NxHxWx2)
+        flow: estimated flow
+        gt: groundtruth flow
+        mask: optional boolean array restricting the evaluation to a certain area of pixels
+        return: dictionary with the AAE, AEE, BP and Fl of the (last) frame, None if it has no valid pixels
+        """
+        if flow.ndim > 3:
+            flow = flow.reshape((-1,) + flow.shape[-3:])
+            gt = np.broadcast_to(gt, flow.shape[:1] + gt.shape[-3:]) if gt.ndim == 3 else gt.reshape(flow.shape)
+            if mask is not None:
+                mask = np.broadcast_to(mask, flow.shape[:-1]).reshape(flow.shape[:-1])
+            measures = None
+            for i in range(flow.shape[0]):
+                measures = self.update(flow[i], gt[i], None if mask is None else mask[i])
+            return measures
+
+        if mask is None:
+            sums = compute_ErrorSums(flow, gt, t1=self.t1, t2=self.t2)
+        else:
+            labels = np.where(mask, 0, -1)
+            sums = {key: value[0] for key, value in compute_ErrorSums_labels(flow, gt, labels, 1, t1=self.t1, t2=self.t2).items()}
+        return self.add(sums)
+
+    def add(self, sums):
+        """add the error sums of a frame computed elsewhere (e.g. by compute_ErrorSums in a worker process)
+        sums: dictionary with keys count, EE, AE, BP, Fl
+        return: dictionary with the AAE, AEE, BP and Fl of the frame, None if it has no valid pixels
+        """
+        for key in self.sums:
+            self.sums[key] += sums[key]
+        if sums["count"] == 0:
+            return None
+        measures = getErrorMeasuresFromSums(sums)
+        for key in self.frame_sums:
+            self.frame_sums[key] += measures[key]
+        self.frames += 1
+        return measures
+
+    def merge(self, other):
+        """add the state of another accumulator with the same thresholds"""
+        if (self.t1, self.t2) != (other.t1, other.t2):
+            raise ValueError("FlowMetricAccumulator.merge: thresholds differ")
+        for key in self.sums:
+            self.sums[key] += other.sums[key]
+        for key in self.frame_sums:
+            self.frame_sums[key] += other.frame_sums[key]
+        self.frames += other.frames
+        return self
+
+    def result(self):
+        """return: dictionary with the keys
+            pixel: AAE, AEE, BP and Fl over all accumulated pixels, None without valid pixels
+            frame: mean of the per-frame AAE, AEE, BP and Fl (frames without valid pixels are left out), None without frames
+            frames: number of frames with valid pixels
+            pixels: number of valid pixels
+        """
+        return {
+            "pixel": getErrorMeasuresFromSums(self.sums) if self.sums["count"] > 0 else None,
+            "frame": {key: value / self.frames for key, value in self.frame_sums.items()} if self.frames > 0 else None,
+            "frames": self.frames,
+            "pixels": self.sums["count"],
+        }
+
+
+class SceneFlowAccumulator:
+    """Accumulates the bad and valid pixel counts behind the KITTI 15 scene flow measures D1, D2, Fl and SF
+    (see compute_SF) over a stream of frames. As in the official KITTI devkit, the percentages are computed
+    from the counts summed over all frames. Accumulators can be combined with merge.
+    """
+
+    def __init__(self, t1=3.0, t2=0.05):
+        """
+        t1, t2: absolute and relative thresholds (see compute_BP)
+        """
+        self.t1 = t1
+        self.t2 = t2
+        self.counts = np.zeros(8, dtype=np.int64)
+
+    def update(self, estimate, gt, mask=None):
+        """add a frame or a batch of frames with leading batch dimensions
+        estimate: tuple (disp0, disp1, flow) of the estimated scene flow
+        gt: tuple (disp0, disp1, flow) of the groundtruth
+        mask: optional boolean array restricting the evaluation to a certain area of pixels (e.g. foreground objects)
+        return: the 8 counts of the frame (summed over the batch)
+        """
+        counts = compute_SF(*estimate, *gt, t1=self.t1, t2=self.t2, area=mask)
+        counts = np.array([np.sum(count) for count in counts], dtype=np.int64)
+        return self.add(counts)
+
+    def add(self, counts):
+        """add counts computed elsewhere, in the order returned by compute_SF"""
+        counts = np.asarray(counts, dtype=np.int64)
+        self.counts += counts
+        return counts
+
+    def merge(self, other):
+        """add the counts of another accumulator with the same thresholds"""
+        if (self.t1, self.t2) != (other.t1, other.t2):
+            raise ValueError("SceneFlowAccumulator.merge: thresholds differ")
+        self.counts += other.counts
+        return self
+
+    def result(self):
+        """return: dictionary with keys D1, D2, Fl, SF and error percentages (see getSFMeasuresFromCounts)"""
+        return getSFMeasuresFromCounts(self.counts)
+
 
 def compute_DisparityError(disp, gt, return_mask=False, t1=3.0, t2=0.05):
+    """compute the KITTI 15 disparity outlier percentage (D1/D2)
+    disp: estimated disparity, HxW or with leading batch dimensions (e.g. NxHxW)
+    gt: groundtruth disparity
+    return_mask: if True, return pixelwise boolean mask instead of aggregated number
+    return: percentage [0;100] (one value per sample for batched input), or mask if return_mask is True
+    """
     error = np.abs(disp - gt)
     # number of valid pixels:
-    count = np.count_nonzero(~np.isnan(error))
+    count = np.count_nonzero(~np.isnan(error), axis=SPATIAL_AXES)
 
     # set the ee of nan pixels to zero
     error = np.nan_to_num(error, nan=0.0)
@@ -177,16 +716,74 @@ def compute_DisparityError(disp, gt, return_mask=False, t1=3.0, t2=0.05):
     if return_mask:
         return bp_mask
     else:
-        return 100 * np.sum(bp_mask) / count
+        return 100 * np.sum(bp_mask, axis=SPATIAL_AXES) / count
 
 
 def compute_absDispError(disp, gt):
     valid = ~np.isnan(gt)
-    return (np.abs(np.nan_to_num(gt)-disp) * valid).sum() / valid.sum()
+    return (np.abs(np.nan_to_num(gt)-disp) * valid).sum(axis=SPATIAL_AXES) / valid.sum(axis=SPATIAL_AXES)
 
 
-def compute_epe3DError(disp2, flow, gt_disp2, gt_flow, intrinsics):
-    target_gt = backproject_flow3d_target(gt_flow, intrinsics[0] / gt_disp2, intrinsics)
-    target_est = backproject_flow3d_target(flow, intrinsics[0] / disp2, intrinsics)
+def compute_epe3DError(disp2, flow, gt_disp2, gt_flow, intrinsics, buffers=None):
+    """compute the average 3D endpoint error between the backprojected targets of the estimate and the groundtruth
+    disp2, flow: estimated disparity (of the target) and flow
+    gt_disp2, gt_flow: groundtruth
+    intrinsics: fx, fy, cx, cy
+    buffers: optional float64 array of shape 2xHxWx3, reused for the backprojected points of repeated calls
+    return: 3D EPE
+    """
+    if buffers is None:
+        buffers = np.empty((2,) + flow.shape[:2] + (3,), dtype=np.float64)
+    target_gt, target_est = buffers
+    # the depth is computed directly into the Z channel of the targets
+    np.divide(intrinsics[0], gt_disp2, out=target_gt[..., 2])
+    np.divide(intrinsics[0], disp2, out=target_est[..., 2])
+    backproject_flow3d_target(gt_flow, target_gt[..., 2], intrinsics, out=target_gt)
+    backproject_flow3d_target(flow, target_est[..., 2], intrinsics, out=target_est)
     valid = ~np.isnan(target_gt.sum(axis=-1))
-    return np.nansum(np.linalg.norm(target_gt-target_est, axis=-1)) / valid.sum()
+
+    # euclidean norm of the difference, in place
+    np.subtract(target_gt, target_est, out=target_est)
+    np.multiply(target_est, target_est, out=target_est)
+    error = target_est[..., 0]
+    np.add(error, target_est[..., 1], out=error)
+    np.add(error, target_est[..., 2], out=error)
+    np.sqrt(error, out=error)
+    return np.nansum(error) / valid.sum()
+
+
+def testErrorHistogram():
+    """
+    Check the percentiles of ErrorHistogram on error distributions with empty bins.
+    """
+    edges = np.linspace(0, 100, 10001)
+    width = edges[1] - edges[0]
+    zero = np.zeros((100, 100, 2))
+
+    # constant errors: every percentile lies in the bin of the constant
+    gt = zero.copy()
+    gt[..., 0] = 5.0
+    hist = ErrorHistogram(ee_edges=edges)
+    hist.update(zero, gt)
+    for q in [0, 10, 50, 90, 100]:
+        assert abs(hist.percentile(q) - 5.0) <= width, f"constant errors: percentile {q} is {hist.percentile(q)}"
+    assert abs(hist.median() - 5.0) <= width
+
+    # uniform errors in [2;3]: no percentile below the smallest error
+    gt[..., 0] = np.linspace(2, 3, gt.shape[0] * gt.shape[1]).reshape(gt.shape[:2])
+    hist = ErrorHistogram(ee_edges=edges)
+    hist.update(zero, gt)
+    percentiles = hist.percentile([0, 1, 50, 99, 100])
+    assert np.all(percentiles >= 2.0 - width) and np.all(percentiles <= 3.0 + width), f"uniform errors: percentiles {percentiles}"
+
+    # two clusters at 1 and 50: percentiles lie inside the clusters, not in the gap between them
+    gt[..., 0] = 1.0
+    gt[gt.shape[0] // 2:, :, 0] = 50.0
+    hist = ErrorHistogram(ee_edges=edges)
+    hist.update(zero, gt)
+    for q, expected in [(10, 1.0), (25, 1.0), (49, 1.0), (51, 50.0), (75, 50.0), (100, 50.0)]:
+        assert abs(hist.percentile(q) - expected) <= width, f"two clusters: percentile {q} is {hist.percentile(q)}"
+
+
+if __name__ == "__main__":
+    testErrorHistogram()
@@ -1,25 +1,33 @@
-import matplotlib
+import os
+import subprocess
+import multiprocessing
 import numpy as np
+from functools import lru_cache
 import flow_errors
+import flow_IO
+
+# visualization types of getFlowVis
+VISTYPES = ["Color Light", "Color Dark", "Color Log", "Color LogLog", "Error", "Error Fl"]
+
+# command of a local ffmpeg for render_sequence, reading raw RGB frames from stdin
+FFMPEG_ENCODER = ["ffmpeg", "-y", "-loglevel", "error", "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", "{width}x{height}",
+                  "-r", "{fps}", "-i", "-", "-pix_fmt", "yuv420p", "{out}"]
 
 
 def colorplot_dark(flow, auto_scale=True, max_scale=-1, transform=None, return_max=False):
     """
     color-codes a flow input using the color-coding by [Bruhn 2006]
+    The input flow is not modified; pixels with nan are black.
     """
-    # prevents nan warnings
     nan = np.isnan(flow[:, :, 0]) | np.isnan(flow[:, :, 1])
-    flow[nan, :] = 0
+    u = np.where(nan, 0, flow[:, :, 0])
+    v = np.where(nan, 0, flow[:, :, 1])
 
-    flow_gradientmag = np.sqrt(flow[:, :, 0]**2 + flow[:, :, 1]**2)
+    flow_gradientmag = np.sqrt(u**2 + v**2)
     if auto_scale:
         max_scale = flow_gradientmag.max()
 
-    hue = -np.arctan2(flow[:, :, 1], flow[:, :, 0]) % (2 * np.pi) / (2 * np.pi) * 360
-    hue[hue < 90] *= 60 / 90
-    hue[(hue < 180) & (hue >= 90)] = (hue[(hue < 180) & (hue >= 90)] - 90) * 60 / 90 + 60
-    hue[hue >= 180] = (hue[hue >= 180] - 180) * 240 / 180 + 120
-    hue /= 360
+    hue = _bruhnHue(u, v)
     if transform is None:
         value = flow_gradientmag / float(max_scale)
     elif transform == "log":
@@ -36,16 +44,11 @@ def colorplot_dark(flow, auto_scale=True, max_scale=-1, transform=None, return_m
         value = np.log10(value)
     else:
         raise ValueError("wrong value for parameter transform")
-    value[value > 1.0] = 1.0
-    sat = np.ones((flow.shape[0], flow.shape[1]))
-    hsv = np.stack((hue, sat, value), axis=-1)
-    rgb = matplotlib.colors.hsv_to_rgb(hsv) * 255
+    np.copyto(value, 1.0, where=value > 1.0)
 
+    rgb = np.empty((flow.shape[0], flow.shape[1], 3), dtype=np.uint8)
+    _hsvToRgb(hue, value, out=rgb)
     rgb[nan, :] = 0
-    rgb = rgb.astype(np.uint8)
-
-    # reset flow
-    flow[nan, :] = np.nan
 
     if return_max:
         return rgb, max_scale
@@ -53,11 +56,53 @@ def colorplot_dark(flow, auto_scale=True, max_scale=-1, transform=None, return_m
         return rgb
 
 
-def colorplot_light(flow, auto_scale=True, max_scale=-1, return_max=False):
+# channel sources (0: v, 1: t, 2: p, 3: q) of the six hue sectors, as in matplotlib.colors.hsv_to_rgb
+_HSV_SECTOR_CHANNELS = np.array([[0, 1, 2], [3, 0, 2], [2, 0, 1], [2, 3, 0], [1, 2, 0], [0, 2, 3]])
+
+
+def _bruhnHue(u, v):
+    """hue in [0;1] of the [Bruhn 2006] color-coding: the flow angle with stretched red-yellow and yellow-green ranges"""
+    hue = -np.arctan2(v, u) % (2 * np.pi) / (2 * np.pi) * 360
+    # the three piecewise linear ranges are selected on the unmapped angle and mapped in place
+    low = hue < 90
+    high = hue >= 180
+    mid = ~(low | high)
+    np.multiply(hue, 60 / 90, out=hue, where=low)
+    for op, operand in [(np.subtract, 90), (np.multiply, 60), (np.divide, 90), (np.add, 60)]:
+        op(hue, operand, out=hue, where=mid)
+    for op, operand in [(np.subtract, 180), (np.multiply, 240), (np.divide, 180), (np.add, 120)]:
+        op(hue, operand, out=hue, where=high)
+    hue /= 360
+    return hue
+
+
+def _hsvToRgb(hue, value, out):
+    """convert hue and value with full saturation to uint8 RGB written into out (shape HxWx3).
+    Uses the arithmetic of matplotlib.colors.hsv_to_rgb in float64, so the result is identical to
+    (hsv_to_rgb(hsv) * 255).astype(np.uint8)."""
+    h6 = hue.astype(np.float64) * 6.0
+    sector = h6.astype(int)
+    f = h6 - sector
+    sector %= 6
+    v = value.astype(np.float64)
+    sources = (v, v * (1.0 - (1.0 - f)), v * 0.0, v * (1.0 - f))
+    channel = np.empty(hue.shape, dtype=np.float64)
+    for i in range(3):
+        np.choose(_HSV_SECTOR_CHANNELS[:, i][sector], sources, out=channel)
+        channel *= 255
+        np.copyto(out[:, :, i], channel, casting="unsafe")
+    return out
+
+
+def colorplot_light(flow, auto_scale=True, max_scale=-1, return_max=False, lut_resolution=None):
     """
     Expects a two dimensional flow image of shape.
+    The input flow is not modified; pixels with nan are black.
     Args:
         flow_uv (np.ndarray): Flow UV image of shape [H,W,2]
+        lut_resolution (int): if None, every pixel is colored exactly. Otherwise the colors are looked up
+            in a cached lut_resolution x lut_resolution table over the flow range scaled by max_scale (nearest entry),
+            which is much faster but approximate, mostly near the max_scale circle.
     Returns:
         np.ndarray: Flow visualization image of shape [H,W,3]
     """
@@ -67,20 +112,32 @@ def colorplot_light(flow, auto_scale=True, max_scale=-1, return_max=False):
     assert flow.shape[2] == 2, 'input flow must have shape [H,W,2]'
 
     nan = np.isnan(flow[:, :, 0]) | np.isnan(flow[:, :, 1])
-    flow[nan, :] = 0
+    u = np.where(nan, 0, flow[:, :, 0])
+    v = np.where(nan, 0, flow[:, :, 1])
 
-    u = flow[:,:,0]
-    v = flow[:,:,1]
     # scale flow by maxvalue
-    rad = np.sqrt(np.square(u) + np.square(v))
     if auto_scale:
-        max_scale = rad.max()
+        max_scale = np.sqrt(np.square(u) + np.square(v)).max()
     epsilon = 1e-5
     u = u / (max_scale + epsilon)
     v = v / (max_scale + epsilon)
 
-    flow_image = np.zeros((u.shape[0], u.shape[1], 3), np.uint8)
-    colorwheel = get_Middlebury_colorwheel()  # shape [55x3]
+    if lut_resolution is None:
+        flow_image = np.empty((u.shape[0], u.shape[1], 3), np.uint8)
+        _middleburyColors(u, v, flow_image)
+        np.copyto(flow_image, 0, where=nan[..., np.newaxis])
+    else:
+        flow_image = _middleburyColorsLut(u, v, nan, int(lut_resolution))
+
+    if return_max:
+        return flow_image, max_scale
+    else:
+        return flow_image
+
+
+def _middleburyColors(u, v, out):
+    """color the scaled flow u, v (radius 1 = max_scale) with the Middlebury colorwheel into the uint8 array out (HxWx3)"""
+    colorwheel = _cachedColorwheel()  # shape [55x3], divided by 255
     ncols = colorwheel.shape[0]
     rad = np.sqrt(np.square(u) + np.square(v))
     a = np.arctan2(-v, -u)/np.pi
@@ -89,73 +146,244 @@ def colorplot_light(flow, auto_scale=True, max_scale=-1, return_max=False):
     k1 = k0 + 1
     k1[k1 == ncols] = 0
     f = fk - k0
+    one_minus_f = 1 - f
+    outside = rad > 1
+    col = np.empty(f.shape, dtype=np.float64)
+    tmp = np.empty(f.shape, dtype=np.float64)
     for i in range(colorwheel.shape[1]):
-        tmp = colorwheel[:,i]
-        col0 = tmp[k0] / 255.0
-        col1 = tmp[k1] / 255.0
-        col = (1-f)*col0 + f*col1
-        idx = (rad <= 1)
-        col[idx]  = 1 - rad[idx] * (1-col[idx])
-        col[~idx] = col[~idx] * 0.75   # out of range
-        flow_image[:,:,i] = np.floor(255 * col)
-        flow_image[nan, i] = 0
-
-    # reset flow
-    flow[nan, :] = np.nan
-
-    if return_max:
-        return flow_image, max_scale
-    else:
-        return flow_image
-
-
-def errorplot(flow, gt):
-    colors = [
-        (0.1875, [49, 53, 148]),
-        (0.375, [69, 116, 180]),
-        (0.75, [115, 173, 209]),
-        (1.5, [171, 216, 233]),
-        (3, [223, 242, 248]),
-        (6, [254, 223, 144]),
-        (12, [253, 173, 96]),
-        (24, [243, 108, 67]),
-        (48, [215, 48, 38]),
-        (np.inf, [165, 0, 38])
-    ]
-
-    ee = flow_errors.compute_EE(flow, gt)
+        # (1-f)*col0 + f*col1 with the masks and indices shared by all channels
+        np.take(colorwheel[:, i], k0, out=col)
+        col *= one_minus_f
+        np.take(colorwheel[:, i], k1, out=tmp)
+        tmp *= f
+        col += tmp
+        # 1 - rad * (1-col) inside the unit circle, darken out of range
+        np.subtract(1, col, out=tmp)
+        tmp *= rad
+        np.subtract(1, tmp, out=col, where=~outside)
+        np.multiply(col, 0.75, out=col, where=outside)
+        col *= 255
+        np.floor(col, out=col)
+        np.copyto(out[:, :, i], col, casting="unsafe")
+    return out
+
+
+# half width of the table of _middleburyLut in scaled flow units, slightly beyond the unit circle of max_scale
+_LUT_RANGE = 1.05
+
+
+def _middleburyColorsLut(u, v, nan, resolution):
+    """approximate _middleburyColors by the nearest entry of a color table (see colorplot_light)"""
+    lut = _middleburyLut(resolution)
+    # move flow beyond the table radially onto its border, which keeps the (out of range) color of its angle
+    border = _LUT_RANGE
+    extent = np.maximum(np.abs(u), np.abs(v))
+    if extent.max() > border:
+        # the factor is exactly 1 inside the table
+        shrink = border / np.maximum(extent, border)
+        u = u * shrink
+        v = v * shrink
+    scale = (resolution - 1) / (2 * border)
+    # the flat index is exact in floating point for any practical resolution
+    iy = np.rint((v + border) * scale)
+    ix = np.rint((u + border) * scale)
+    iy *= resolution
+    iy += ix
+    index = iy.astype(np.intp)
+    # nan pixels use the black entry behind the table
+    np.copyto(index, resolution * resolution, where=nan)
+    return np.take(lut, index, axis=0)
+
+
+@lru_cache(maxsize=None)
+def _cachedColorwheel():
+    colorwheel = get_Middlebury_colorwheel() / 255.0
+    colorwheel.flags.writeable = False
+    return colorwheel
 
-    nan = np.isnan(ee)
-    ee = np.nan_to_num(ee)
-    result = np.zeros((ee.shape[0], ee.shape[1], 3), dtype=np.uint8)
 
-    for threshold, color in reversed(colors):
-        result[ee < threshold, :] = color
+@lru_cache(maxsize=4)
+def _middleburyLut(resolution):
+    """flattened color table of colorplot_light with resolution x resolution entries over the scaled flow range
+    [-_LUT_RANGE,_LUT_RANGE]^2 (row-major in v, u), followed by one black entry"""
+    grid = np.linspace(-_LUT_RANGE, _LUT_RANGE, resolution)
+    v, u = np.meshgrid(grid, grid, indexing="ij")
+    lut = np.zeros((resolution * resolution + 1, 3), np.uint8)
+    _middleburyColors(u, v, lut[:-1].reshape(resolution, resolution, 3))
+    lut.flags.writeable = False
+    return lut
+
+
+# upper endpoint error bounds and colors of errorplot, followed by black for pixels without groundtruth
+ERRORPLOT_THRESHOLDS = np.array([0.1875, 0.375, 0.75, 1.5, 3, 6, 12, 24, 48, np.inf])
+ERRORPLOT_PALETTE = np.array([
+    [49, 53, 148],
+    [69, 116, 180],
+    [115, 173, 209],
+    [171, 216, 233],
+    [223, 242, 248],
+    [254, 223, 144],
+    [253, 173, 96],
+    [243, 108, 67],
+    [215, 48, 38],
+    [165, 0, 38],
+    [0, 0, 0],
+], dtype=np.uint8)
+
+# colors of errorplot_Fl: good, bad and no groundtruth
+ERRORPLOT_FL_PALETTE = np.array([[0, 255, 0], [255, 0, 0], [0, 0, 0]], dtype=np.uint8)
+
+
+def errorplot(flow, gt, ee=None):
+    """color-code the endpoint error with ERRORPLOT_PALETTE, pixels without groundtruth are black
+    flow: estimated flow
+    gt: groundtruth flow
+    ee: optional precomputed endpoint error (see flow_errors.compute_EE)
+    """
+    if ee is None:
+        ee = flow_errors.compute_EE(flow, gt)
 
+    # bin i holds the errors in [thresholds[i-1], thresholds[i]), infinite errors get the last color
+    index = np.searchsorted(ERRORPLOT_THRESHOLDS, ee, side="right")
+    np.minimum(index, len(ERRORPLOT_THRESHOLDS) - 1, out=index)
     # set nan values to black
-    result[nan, :] = [0, 0, 0]
+    np.copyto(index, len(ERRORPLOT_THRESHOLDS), where=np.isnan(ee))
+    return np.take(ERRORPLOT_PALETTE, index, axis=0)
 
-    return result
 
-
-def errorplot_Fl(flow, gt):
-    ee = flow_errors.compute_EE(flow, gt)
+def errorplot_Fl(flow, gt, ee=None, fl_mask=None):
+    """show the bad pixels of the Fl measure in red and the others in green, pixels without groundtruth are black
+    flow: estimated flow
+    gt: groundtruth flow
+    ee: optional precomputed endpoint error (see flow_errors.compute_EE)
+    fl_mask: optional precomputed bad pixel mask, e.g. flow_errors.compute_Fl(..., return_mask=True);
+        by default pixels with an endpoint error >= 3px and >= 5% of the groundtruth vector length are bad
+    """
+    if ee is None:
+        ee = flow_errors.compute_EE(flow, gt)
     nan = np.isnan(ee)
-    ee = np.nan_to_num(ee)
-    result = np.zeros((ee.shape[0], ee.shape[1], 3), dtype=np.uint8)
 
-    abs_err = ee >= 3.0
+    if fl_mask is None:
+        ee = np.nan_to_num(ee)
+        abs_err = ee >= 3.0
 
-    gt_vec_length = np.sqrt(np.square(gt[..., 0]) + np.square(gt[..., 1]))
-    rel_err = ee >= 0.05 * gt_vec_length
+        gt_vec_length = np.sqrt(np.square(gt[..., 0]) + np.square(gt[..., 1]))
+        rel_err = ee >= 0.05 * gt_vec_length
 
-    bp_mask = abs_err & rel_err
+        fl_mask = abs_err & rel_err
 
-    result[:,:,:] = (0, 255, 0)
-    result[bp_mask,:] = (255, 0, 0)
+    index = fl_mask.astype(np.intp)
+    np.copyto(index, 2, where=nan)
+    return np.take(ERRORPLOT_FL_PALETTE, index, axis=0)
 
-    result[nan, :] = [0,0,0]
-    return result
+
+def getFlowVis(flow, vistype="Color Light", auto_scale=False, max_scale=-1, gt=None, return_max=False, ee=None, fl_mask=None):
+    """visualize a flow field with one of VISTYPES
+    flow: flow field
+    vistype: visualization type, the error types need the groundtruth gt
+    auto_scale, max_scale, return_max: see colorplot_light and colorplot_dark
+    gt: optional groundtruth flow
+    ee, fl_mask: optional precomputed endpoint error and Fl mask for the error types (see errorplot and errorplot_Fl)
+    """
+    if vistype == "Color Light":
+        return colorplot_light(flow, auto_scale=auto_scale, max_scale=max_scale, return_max=return_max)
+    if vistype == "Color Dark":
+        return colorplot_dark(flow, auto_scale=auto_scale, max_scale=max_scale, return_max=return_max)
+    elif vistype == "Color Log":
+        return colorplot_dark(flow, auto_scale=auto_scale, transform="log", max_scale=max_scale, return_max=return_max)
+    elif vistype == "Color LogLog":
+        return colorplot_dark(flow, auto_scale=auto_scale, transform="loglog", max_scale=max_scale, return_max=return_max)
+    elif vistype == "Error":
+        if gt is None:
+            return np.zeros((flow.shape[0], flow.shape[1]))
+        else:
+            return errorplot(flow, gt, ee=ee)
+    elif vistype == "Error Fl":
+        if gt is None:
+            return np.zeros((flow.shape[0], flow.shape[1]))
+        else:
+            return errorplot_Fl(flow, gt, ee=ee, fl_mask=fl_mask)
+
+
+def render_sequence(paths, out, vistype="Color Light", workers=None, max_scale=None, gt_paths=None, encoder=None, fps=25, scale_stride=1):
+    """render a sequence of flow files to png frames or a video on a process pool.
+    paths: flow files in frame order
+    out: output folder of the png frames frame_000000.png, ... or, with an encoder, the output file of the encoder
+    vistype: visualization type (see VISTYPES); the error types need gt_paths
+    workers: number of processes, defaults to the number of CPUs
+    max_scale: flow length mapped to full saturation for the color types:
+        None: the maximum over all frames, computed in a first pass (see scale_stride)
+        "frame": the maximum of every single frame (colors are not comparable between frames)
+        number: a fixed value
+    gt_paths: groundtruth flow files in frame order
+    encoder: optional command of a local encoder process reading raw RGB frames from stdin (e.g. FFMPEG_ENCODER);
+        "{width}", "{height}", "{fps}" and "{out}" in the arguments are replaced
+    fps: frame rate passed to the encoder
+    scale_stride: if > 1, the first pass only reads every scale_stride-th row and column, which is cheaper but
+        may miss the largest flow vectors; flow beyond the resulting max_scale is drawn with the out-of-range color
+    returns: (list of png files or out, max_scale)
+    """
+    paths = list(paths)
+    if vistype not in VISTYPES:
+        raise ValueError(f"unknown vistype {vistype}, expected one of {VISTYPES}")
+    if vistype.startswith("Error"):
+        if gt_paths is None or len(gt_paths) != len(paths):
+            raise ValueError(f"vistype {vistype} needs one groundtruth file per flow file")
+    else:
+        gt_paths = None
+    gt_paths = [None] * len(paths) if gt_paths is None else list(gt_paths)
+
+    with multiprocessing.Pool(workers) as p:
+        if max_scale is None and not vistype.startswith("Error"):
+            max_scale = max(p.imap_unordered(_maxFlowLength, [(path, scale_stride) for path in paths], chunksize=4), default=0.0)
+
+        if encoder is None:
+            os.makedirs(out, exist_ok=True)
+            outputs = [os.path.join(out, f"frame_{i:06d}.png") for i in range(len(paths))]
+            tasks = [(path, gt_path, vistype, max_scale, output) for path, gt_path, output in zip(paths, gt_paths, outputs)]
+            for _ in p.imap_unordered(_renderFrame, tasks):
+                pass
+            return outputs, max_scale
+
+        tasks = [(path, gt_path, vistype, max_scale, None) for path, gt_path in zip(paths, gt_paths)]
+        process = None
+        try:
+            for rgb in p.imap(_renderFrame, tasks):
+                height, width = rgb.shape[:2]
+                if process is None:
+                    command = [arg.format(width=width, height=height, fps=fps, out=out) for arg in encoder]
+                    process = subprocess.Popen(command, stdin=subprocess.PIPE)
+                    frame_size = (height, width)
+                elif frame_size != (height, width):
+                    raise ValueError(f"frame size changed from {frame_size} to {(height, width)}")
+                process.stdin.write(np.ascontiguousarray(rgb, dtype=np.uint8).tobytes())
+        finally:
+            if process is not None:
+                process.stdin.close()
+                process.wait()
+        if process is not None and process.returncode != 0:
+            raise IOError(f"encoder {encoder[0]} failed with exit code {process.returncode}")
+        return out, max_scale
+
+
+def _maxFlowLength(args):
+    path, stride = args
+    flow = flow_IO.readFlowFile(path, stride=stride)
+    length = np.sqrt(np.square(flow[:, :, 0]) + np.square(flow[:, :, 1]))
+    return float(np.nanmax(length, initial=0.0))
+
+
+def _renderFrame(args):
+    path, gt_path, vistype, max_scale, output = args
+    flow = flow_IO.readFlowFile(path)
+    gt = None if gt_path is None else flow_IO.readFlowFile(gt_path)
+    if max_scale == "frame":
+        rgb = getFlowVis(flow, vistype=vistype, auto_scale=True, gt=gt)
+    else:
+        rgb = getFlowVis(flow, vistype=vistype, max_scale=max_scale, gt=gt)
+    if output is None:
+        return rgb
+    flow_IO.writePngMapFile(rgb, output)
 
 
 def get_Middlebury_colorwheel():
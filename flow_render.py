@@ -0,0 +1,42 @@
+#! /usr/bin/python3
+
+import argparse
+
+import flow_plot
+import flow_datasets
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a sequence of flow files to png frames or a video.")
+    parser.add_argument("out", help="output folder of the png frames, or the video file with --video")
+    parser.add_argument("flowfiles", nargs="+", help="flow files in frame order")
+    parser.add_argument("--vistype", default="Color Light", choices=flow_plot.VISTYPES)
+    parser.add_argument("--workers", type=int, default=None, help="number of processes (default: number of CPUs)")
+    parser.add_argument("--max-scale", default=None,
+                        help="flow length of full saturation: a number, 'frame' for per-frame scaling (default: maximum of all frames)")
+    parser.add_argument("--video", action="store_true", help="pipe the frames into ffmpeg instead of writing png frames")
+    parser.add_argument("--scale-stride", type=int, default=1,
+                        help="compute the default max-scale on every n-th row and column only; faster, but may miss the largest flow (default: 1)")
+    parser.add_argument("--fps", type=int, default=25)
+    args = parser.parse_args()
+
+    max_scale = args.max_scale
+    if max_scale is not None and max_scale != "frame":
+        max_scale = float(max_scale)
+
+    gt_paths = None
+    if args.vistype.startswith("Error"):
+        gt_paths = [flow_datasets.findGroundtruth(path) for path in args.flowfiles]
+        if None in gt_paths:
+            parser.error(f"no groundtruth found for {args.flowfiles[gt_paths.index(None)]}")
+
+    encoder = flow_plot.FFMPEG_ENCODER if args.video else None
+    _, max_scale = flow_plot.render_sequence(args.flowfiles, args.out, vistype=args.vistype, workers=args.workers, max_scale=max_scale,
+                                             gt_paths=gt_paths, encoder=encoder, fps=args.fps,
+                                             scale_stride=args.scale_stride)
+    if max_scale is not None:
+        print(f"max_scale: {max_scale}")
+
+
+if __name__ == "__main__":
+    main()
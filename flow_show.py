@@ -5,7 +5,6 @@ import os
 
 import matplotlib.pyplot as plt
 from matplotlib.widgets import Slider, RadioButtons
-import numpy as np
 
 import flow_plot
 import flow_IO
@@ -13,25 +12,8 @@ import flow_datasets
 import flow_errors
 
 
-def getFlowVis(flow, vistype="Color Light", auto_scale=False, max_scale=-1, gt=None, return_max=False):
-    if vistype == "Color Light":
-        return flow_plot.colorplot_light(flow, auto_scale=auto_scale, max_scale=max_scale, return_max=return_max)
-    if vistype == "Color Dark":
-        return flow_plot.colorplot_dark(flow, auto_scale=auto_scale, max_scale=max_scale, return_max=return_max)
-    elif vistype == "Color Log":
-        return flow_plot.colorplot_dark(flow, auto_scale=auto_scale, transform="log", max_scale=max_scale, return_max=return_max)
-    elif vistype == "Color LogLog":
-        return flow_plot.colorplot_dark(flow, auto_scale=auto_scale, transform="loglog", max_scale=max_scale, return_max=return_max)
-    elif vistype == "Error":
-        if gt is None:
-            return np.zeros((flow.shape[0], flow.shape[1]))
-        else:
-            return flow_plot.errorplot(flow, gt)
-    elif vistype == "Error Fl":
-        if gt is None:
-            return np.zeros((flow.shape[0], flow.shape[1]))
-        else:
-            return flow_plot.errorplot_Fl(flow, gt)
+# kept here for existing callers, the visualization lives in flow_plot
+getFlowVis = flow_plot.getFlowVis
 
 
 def maximizeWindow():
@@ -49,6 +31,7 @@ def showFlow(filepath):
     filepath = os.path.abspath(filepath)
     flow = flow_IO.readFlowFile(filepath)
     gt_flow = None
+    gt_ee = None
 
     dir_name = os.path.dirname(filepath)
     dir_entries = [os.path.join(dir_name, i) for i in sorted(os.listdir(dir_name))]
@@ -65,29 +48,33 @@ def showFlow(filepath):
     axslider = plt.axes([0.05, 0.085, 0.6, 0.03])
     axbuttons = plt.axes([0.7, 0.005, 0.25, 0.195], frame_on=False, aspect='equal')
     slider = Slider(axslider, "max", valmin=0, valmax=200, valinit=max_scale, closedmin=False)
-    buttons = RadioButtons(axbuttons, ["Color Light", "Color Dark", "Color Log", "Color LogLog", "Error", "Error Fl"])
+    buttons = RadioButtons(axbuttons, flow_plot.VISTYPES)
 
     def updateEverything():
         nonlocal flow
         nonlocal gt_flow
+        nonlocal gt_ee
         plt.get_current_fig_manager().set_window_title(filepath)
         flow = flow_IO.readFlowFile(filepath)
         gt = None
+        gt_flow = None
+        gt_ee = None
         try:
             gt = flow_datasets.findGroundtruth(filepath)
         except Exception as e:
             print(e)
         if gt:
-            gt_flow = flow_IO.readFlowFile(gt)
-            errors = flow_errors.getAllErrorMeasures(flow, gt_flow)
-            fig.suptitle(f"AEE: {errors['AEE']:.3f}, Fl: {errors['Fl']:.3f}")
-        colorvis = getFlowVis(flow, vistype=buttons.value_selected, max_scale=slider.val, gt=gt_flow)
+            gt_flow = flow_datasets.getGroundtruthCache().readFlow(gt)
+            # the endpoint error is shared by the measures and the error visualizations
+            gt_ee = flow_errors.compute_EE(flow, gt_flow)
+            fig.suptitle(f"AEE: {flow_errors.compute_AEE(flow, gt_flow, ee=gt_ee):.3f}, Fl: {flow_errors.compute_Fl(flow, gt_flow, ee=gt_ee):.3f}")
+        colorvis = getFlowVis(flow, vistype=buttons.value_selected, max_scale=slider.val, gt=gt_flow, ee=gt_ee)
         ax_implot.set_data(colorvis)
         fig.canvas.draw_idle()
 
     def update(val):
         val = slider.val
-        colorvis = getFlowVis(flow, vistype=buttons.value_selected, max_scale=val, gt=gt_flow)
+        colorvis = getFlowVis(flow, vistype=buttons.value_selected, max_scale=val, gt=gt_flow, ee=gt_ee)
         ax_implot.set_data(colorvis)
         fig.canvas.draw_idle()
 
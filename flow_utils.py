@@ -1,4 +1,32 @@
 import numpy as np
+from functools import lru_cache
+
+
+@lru_cache(maxsize=16)
+def getPixelGrid(ht, wd):
+    """ Cached pixel coordinates x0, y0 of an ht x wd image (read-only int arrays of shape ht x wd) """
+    y0, x0 = np.meshgrid(np.arange(ht), np.arange(wd))
+    x0 = np.ascontiguousarray(x0.T)
+    y0 = np.ascontiguousarray(y0.T)
+    x0.flags.writeable = False
+    y0.flags.writeable = False
+    return x0, y0
+
+
+def getNormalizedPixelGrid(ht, wd, intrinsics):
+    """ Cached normalized image coordinates (x0 - cx) / fx, (y0 - cy) / fy of an ht x wd image """
+    fx, fy, cx, cy = (float(v) for v in intrinsics)
+    return _normalizedPixelGrid(ht, wd, fx, fy, cx, cy)
+
+
+@lru_cache(maxsize=16)
+def _normalizedPixelGrid(ht, wd, fx, fy, cx, cy):
+    x0, y0 = getPixelGrid(ht, wd)
+    nx = (x0 - cx) / fx
+    ny = (y0 - cy) / fy
+    nx.flags.writeable = False
+    ny.flags.writeable = False
+    return nx, ny
 
 
 def project(Xs, intrinsics):
@@ -14,20 +42,19 @@ def project(Xs, intrinsics):
     return coords
 
 
-def inv_project(depths, intrinsics):
-    """ Pinhole camera inverse-projection """
+def inv_project(depths, intrinsics, out=None):
+    """ Pinhole camera inverse-projection, optionally into a caller-provided ht x wd x 3 buffer """
 
     ht, wd = depths.shape
-    
-    fx, fy, cx, cy = intrinsics
-
-    y, x = np.meshgrid(np.arange(ht), np.arange(wd))
 
-    X = depths * ((x.T - cx) / fx)
-    Y = depths * ((y.T - cy) / fy)
-    Z = depths
+    nx, ny = getNormalizedPixelGrid(ht, wd, intrinsics)
 
-    return np.stack([X, Y, Z], axis=-1)
+    if out is None:
+        out = np.empty((ht, wd, 3), dtype=np.result_type(depths, nx))
+    np.multiply(depths, nx, out=out[..., 0])
+    np.multiply(depths, ny, out=out[..., 1])
+    out[..., 2] = depths
+    return out
 
 
 def backproject_flow3d(flow2d, depth0, depth1, intrinsics, T=None, return_2d=False):
@@ -35,25 +62,8 @@ def backproject_flow3d(flow2d, depth0, depth1, intrinsics, T=None, return_2d=Fal
 
     ht, wd = flow2d.shape[0:2]
 
-    fx, fy, cx, cy = intrinsics
-    
-    y0, x0 = np.meshgrid(np.arange(ht), np.arange(wd))
-    x0 = x0.T
-    y0 = y0.T
-
-    x1 = x0 + flow2d[...,0]
-    y1 = y0 + flow2d[...,1]
-
-    X0 = depth0 * ((x0 - cx) / fx)
-    Y0 = depth0 * ((y0 - cy) / fy)
-    Z0 = depth0
-
-    point0 = np.stack([X0, Y0, Z0], axis=-1)
-
-    X1 = depth1 * ((x1 - cx) / fx)
-    Y1 = depth1 * ((y1 - cy) / fy)
-    Z1 = depth1
-    point1 = np.stack([X1, Y1, Z1], axis=-1)
+    point0 = inv_project(depth0, intrinsics)
+    point1 = backproject_flow3d_target(flow2d, depth1, intrinsics)
 
     if T is not None:
         point1_hom = np.dstack((point1, np.ones((ht,wd))))
@@ -75,25 +85,28 @@ def backproject_flow3d(flow2d, depth0, depth1, intrinsics, T=None, return_2d=Fal
     return flow3d, flow2d
 
 
-def backproject_flow3d_target(flow2d, depth1, intrinsics):
-    """ compute 3D flow from 2D flow + depth change """
+def backproject_flow3d_target(flow2d, depth1, intrinsics, out=None):
+    """ compute the 3D target points of 2D flow + depth, optionally into a caller-provided ht x wd x 3 buffer.
+    out may share its last channel with depth1 (e.g. depth1 = out[..., 2]) """
 
     ht, wd = flow2d.shape[0:2]
 
     fx, fy, cx, cy = intrinsics
-    
-    y0, x0 = np.meshgrid(np.arange(ht), np.arange(wd))
-    x0 = x0.T
-    y0 = y0.T
-
-    x1 = x0 + flow2d[...,0]
-    y1 = y0 + flow2d[...,1]
 
-    X1 = depth1 * ((x1 - cx) / fx)
-    Y1 = depth1 * ((y1 - cy) / fy)
-    Z1 = depth1
-    point1 = np.stack([X1, Y1, Z1], axis=-1)
-    return point1
+    x0, y0 = getPixelGrid(ht, wd)
+
+    if out is None:
+        out = np.empty((ht, wd, 3), dtype=np.result_type(x0, flow2d, depth1))
+    # same operation order as depth1 * ((x0 + u - cx) / fx), evaluated in place
+    for i, (grid, f, c) in enumerate([(x0, fx, cx), (y0, fy, cy)]):
+        channel = out[..., i]
+        np.add(grid, flow2d[..., i], out=channel)
+        np.subtract(channel, c, out=channel)
+        np.divide(channel, f, out=channel)
+        np.multiply(depth1, channel, out=channel)
+    if not np.shares_memory(out[..., 2], depth1):
+        out[..., 2] = depth1
+    return out
 
 
 def undo_motioncompensation(flow3d, depth, intrinsics, T):